@@ -1,15 +1,31 @@
+import time
+_SCRIPT_STARTED = time.perf_counter()
 import streamlit as st
 import pandas as pd
-import gspread
-from oauth2client.service_account import ServiceAccountCredentials
-from googleapiclient.discovery import build
-from googleapiclient.http import MediaIoBaseUpload
+import numpy as np
 from datetime import datetime
-import time
-import bcrypt
 import re
 import io
+import os
+import base64
+import hashlib
+import hmac
+import secrets
+import html
 import logging
+import sqlite3
+import threading
+import queue
+import json
+from contextlib import contextmanager
+import random
+import difflib
+import zlib
+import socket
+from concurrent.futures import Future, ThreadPoolExecutor
+from collections import OrderedDict, deque
+# gspread, googleapiclient, google-auth, openpyxl ו-bcrypt נטענים רק בפונקציות שצריכות אותם
+_IMPORTS_MS = (time.perf_counter() - _SCRIPT_STARTED) * 1000
 
 # --- 1. הגדרת עמוד ---
 st.set_page_config(page_title="ניהול ספקים", layout="wide", initial_sidebar_state="collapsed")
@@ -22,8 +38,112 @@ SCOPE = [
 SHEET_NAME = "ניהול ספקים"
 BCRYPT_ROUNDS = 12
 
+# מקור הנתונים: "sheets" (ברירת מחדל) או "sqlite" לעבודה מקומית / בדיקות עומס
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "sheets")
+SQLITE_PATH = os.environ.get("SQLITE_PATH", "local_store.db")
+
+SUPPLIER_COLUMNS = ['שם הספק', 'תחום עיסוק', 'טלפון', 'כתובת', 'תנאי תשלום', 'אימייל', 'שם איש קשר', 'נוסף על ידי',
+                    'link_agreement', 'link_bank', 'link_tax_books', 'link_books', 'link_invoice']
+WORKSHEET_HEADERS = {
+    "suppliers": SUPPLIER_COLUMNS,
+    "pending_suppliers": SUPPLIER_COLUMNS + ['תאריך הגשה'],
+    "rejected_suppliers": SUPPLIER_COLUMNS + ['תאריך הגשה', 'תאריך דחייה'],
+    "users": ['username', 'password', 'role', 'name'],
+    "pending_users": ['username', 'password', 'name', 'date'],
+    "active_users": ['username', 'last_seen'],
+    "settings": ['fields', 'payment_terms'],
+}
+
 logging.basicConfig(level=logging.ERROR, format='%(asctime)s - %(levelname)s - %(message)s')
 
+# --- מדידת ביצועים ---
+# כל קריאה ל-Google, פגיעה/החטאה במטמון ואזור רינדור נמדדים. האירועים נאספים לכל ריצה
+# (לפאנל המנהל), ואירוע איטי מ-PERF_SLOW_MS נכתב כשורת JSON ללוג "perf".
+# PERF_LOG_ALL=1 כותב את כל האירועים, כולל סיכום לכל ריצה.
+PERF_SLOW_MS = float(os.environ.get("PERF_SLOW_MS", 500))
+PERF_LOG_ALL = os.environ.get("PERF_LOG_ALL") == "1"
+PERF_HISTORY = 20
+
+perf_logger = logging.getLogger("perf")
+perf_logger.setLevel(logging.INFO)
+perf_logger.propagate = False
+if not perf_logger.handlers:
+    _perf_handler = logging.StreamHandler()
+    _perf_handler.setFormatter(logging.Formatter('%(message)s'))
+    perf_logger.addHandler(_perf_handler)
+
+_perf_local = threading.local()
+
+def perf_event(kind, name, ms=0.0, **fields):
+    event = {'ts': datetime.now().isoformat(timespec='milliseconds'), 'kind': kind, 'name': name,
+             'ms': round(ms, 2), 'thread': threading.current_thread().name, **fields}
+    trace = getattr(_perf_local, 'trace', None)
+    if trace is not None: trace.append(event)
+    if PERF_LOG_ALL or ms >= PERF_SLOW_MS:
+        perf_logger.info(json.dumps(dict(event, slow=ms >= PERF_SLOW_MS), ensure_ascii=False, default=str))
+
+@contextmanager
+def perf_span(kind, name, **fields):
+    t0 = time.perf_counter()
+    try: yield
+    finally: perf_event(kind, name, (time.perf_counter() - t0) * 1000, **fields)
+
+@contextmanager
+def perf_trace(name):
+    """
+    אוסף את כל האירועים של ריצת סקריפט אחת בתהליכון הנוכחי. ריצה חלקית של fragment
+    מקבלת trace משלה; בתוך ריצה מלאה היא נמדדת כקטע רגיל.
+    """
+    if getattr(_perf_local, 'trace', None) is not None:
+        with perf_span('section', name): yield _perf_local.trace
+        return
+    _perf_local.trace = []
+    _perf_local.started = t0 = time.perf_counter()
+    try: yield _perf_local.trace
+    finally:
+        trace, _perf_local.trace = _perf_local.trace, None
+        summary = dict(summarize_trace(trace, (time.perf_counter() - t0) * 1000), run=name)
+        if PERF_LOG_ALL or summary['total_ms'] >= PERF_SLOW_MS:
+            perf_logger.info(json.dumps(dict(summary, kind='rerun'), ensure_ascii=False))
+        history = st.session_state.setdefault('perf_history', [])
+        history.append(summary)
+        del history[:-PERF_HISTORY]
+
+def current_trace():
+    """(האירועים עד עכשיו בריצה הנוכחית, זמן שעבר מתחילתה ב-ms)"""
+    started = getattr(_perf_local, 'started', time.perf_counter())
+    return list(getattr(_perf_local, 'trace', None) or []), (time.perf_counter() - started) * 1000
+
+def summarize_trace(trace, total_ms):
+    summary = {'ts': datetime.now().strftime(TS_FORMAT), 'total_ms': round(total_ms, 1), 'api_calls': 0,
+               'api_ms': 0.0, 'cache_hits': 0, 'cache_misses': 0}
+    for e in trace:
+        if e['kind'] in ('sheets_read', 'sheets_write', 'drive'):
+            summary['api_calls'] += 1
+            summary['api_ms'] += e['ms']
+        elif e['kind'] == 'cache':
+            summary['cache_hits' if e['name'].endswith('hit') else 'cache_misses'] += 1
+    summary['api_ms'] = round(summary['api_ms'], 1)
+    return summary
+
+class StartupStats:
+    """זמני ההפעלה הקרה של התהליך: יבוא המודולים בריצה הראשונה, הריצה הראשונה והכניסה הראשונה."""
+
+    def __init__(self):
+        self.imports_ms = round(_IMPORTS_MS, 1)
+        self.first_run_ms = None
+        self.first_login_ms = None
+
+    def record(self, summary, login):
+        changed = False
+        if self.first_run_ms is None: self.first_run_ms, changed = summary['total_ms'], True
+        if login and self.first_login_ms is None: self.first_login_ms, changed = summary['total_ms'], True
+        if changed: perf_logger.info(json.dumps(dict(vars(self), kind='startup'), ensure_ascii=False))
+
+@st.cache_resource
+def get_startup_stats():
+    return StartupStats()
+
 # --- 3. פונקציות עזר (לוגיקה ואבטחה) ---
 
 def normalize_text(text):
@@ -33,7 +153,8 @@ def normalize_text(text):
 def validate_password_strength(password):
     return len(password) >= 6
 
-def hash_password(password):
+def compute_password_hash(password):
+    import bcrypt
     try:
         hashed = bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt(rounds=BCRYPT_ROUNDS))
         return hashed.decode('utf-8')
@@ -42,38 +163,121 @@ def hash_password(password):
         return None
 
 def check_password(plain_text_password, hashed_password):
+    import bcrypt
     try:
         if not plain_text_password or not hashed_password: return False
         return bcrypt.checkpw(plain_text_password.encode('utf-8'), hashed_password.encode('utf-8'))
     except ValueError: return False
 
+# --- טוקני "זכור אותי" ---
+# טוקן חתום (HMAC) עם תוקף, שנשמר בעוגיה בדפדפן (לא בכתובת הדף, שם הוא היה דולף להיסטוריה,
+# ללוגים ולקישורים משותפים). משתמש חוזר נכנס בלי בדיקת bcrypt.
+# הטוקן כולל טביעה של ה-hash הנוכחי, כך ששינוי סיסמה מבטל טוקנים קיימים.
+REMEMBER_ME_DAYS = 14
+SESSION_COOKIE = "sapakim_session"
+AUTH_WORKERS = 2
+
+@st.cache_resource
+def get_session_secret():
+    secret = os.environ.get("SESSION_SECRET")
+    if not secret:
+        try: secret = st.secrets["session_secret"]
+        except Exception: secret = None
+    if not secret:
+        logging.warning("session_secret is not configured; remember-me tokens will not survive a restart")
+        return secrets.token_bytes(32)
+    return str(secret).encode('utf-8')
+
+def _password_fingerprint(hashed_password):
+    return hashlib.sha256(str(hashed_password).encode('utf-8')).hexdigest()[:16]
+
+def _sign(payload):
+    return hmac.new(get_session_secret(), payload.encode('utf-8'), hashlib.sha256).hexdigest()
+
+def make_session_token(username, hashed_password, days=REMEMBER_ME_DAYS):
+    expires = int(time.time() + days * 86400)
+    payload = f"{username}|{expires}|{_password_fingerprint(hashed_password)}"
+    return base64.urlsafe_b64encode(f"{payload}|{_sign(payload)}".encode('utf-8')).decode('ascii')
+
+def read_session_token(token):
+    """מחזיר (שם משתמש, טביעת סיסמה) לטוקן תקף, אחרת None."""
+    try:
+        username, expires, fingerprint, sig = base64.urlsafe_b64decode(token.encode('ascii')).decode('utf-8').rsplit("|", 3)
+    except Exception: return None
+    if not hmac.compare_digest(sig, _sign(f"{username}|{expires}|{fingerprint}")): return None
+    if int(expires) < time.time(): return None
+    return username, fingerprint
+
+@st.cache_resource
+def get_auth_pool():
+    # bcrypt רץ מחוץ לתהליכון של הסקריפט ובמקביליות מוגבלת, כדי שגל התחברויות לא יתפוס את כל המעבדים
+    return ThreadPoolExecutor(max_workers=AUTH_WORKERS, thread_name_prefix="auth")
+
+def verify_password(plain_text_password, hashed_password):
+    with perf_span('auth', 'bcrypt check'):
+        return get_auth_pool().submit(check_password, plain_text_password, hashed_password).result()
+
+def hash_password(password):
+    with perf_span('auth', 'bcrypt hash'):
+        return get_auth_pool().submit(compute_password_hash, password).result()
+
 def is_valid_email(email):
     pattern = r'^[\w\.-]+@[\w\.-]+\.\w+$'
     return re.match(pattern, email) is not None
 
-def check_duplicate_supplier(df, name, phone, email):
-    if df.empty: return False, ""
-    
-    norm_name = normalize_text(name)
-    norm_phone = normalize_text(phone)
-    norm_email = normalize_text(email)
-    
-    try:
-        existing_names = df['שם הספק'].astype(str).str.strip().str.lower().values
-        if norm_name in existing_names: return True, f"שם '{name}' כבר קיים."
+def normalize_phone(phone):
+    """ספרות בלבד, בלי קידומת 972 ובלי אפסים מובילים (Sheets מוחק אותם ממספרים)."""
+    if phone is None: return ""
+    digits = re.sub(r'\D', '', str(phone))
+    if digits.startswith('972'): digits = digits[3:]
+    return digits.lstrip('0')
 
-        if norm_phone:
-            existing_phones = df['טלפון'].astype(str).str.strip().str.lower().values
-            if norm_phone in existing_phones: return True, f"טלפון '{phone}' כבר קיים."
+def supplier_dup_keys(df):
+    """(שמות, טלפונים, אימיילים) של df מנורמלים כמו ב-SupplierIndex, כ-Series וקטוריות."""
+    col = lambda c: df[c].astype(str) if c in df.columns else pd.Series("", index=df.index)
+    names = col('שם הספק').str.strip().str.lower()
+    phones = col('טלפון').str.replace(r'\D', '', regex=True).str.replace(r'^972', '', regex=True).str.lstrip('0')
+    emails = col('אימייל').str.strip().str.lower()
+    return names, phones, emails
 
-        if norm_email:
-            existing_emails = df['אימייל'].astype(str).str.strip().str.lower().values
-            if norm_email in existing_emails: return True, f"אימייל '{email}' כבר קיים."
-    except KeyError: pass
-        
-    return False, ""
+class SupplierIndex:
+    """אינדקס גיבוב של שם, טלפון ואימייל לבדיקת כפילויות ב-O(1) לכל ספק."""
+
+    def __init__(self, df):
+        self.names, self.phones, self.emails = set(), set(), set()
+        if df.empty: return
+        if 'שם הספק' in df.columns: self.names = set(df['שם הספק'].astype(str).str.strip().str.lower())
+        if 'טלפון' in df.columns: self.phones = {normalize_phone(p) for p in df['טלפון'].tolist()} - {""}
+        if 'אימייל' in df.columns: self.emails = set(df['אימייל'].astype(str).str.strip().str.lower()) - {""}
 
-def validate_supplier_form(df, name, fields, phone, email, addr, pay, files_dict):
+    def find_duplicate(self, name, phone, email):
+        if normalize_text(name) in self.names: return True, f"שם '{name}' כבר קיים."
+        norm_phone = normalize_phone(phone)
+        if norm_phone and norm_phone in self.phones: return True, f"טלפון '{phone}' כבר קיים."
+        norm_email = normalize_text(email)
+        if norm_email and norm_email in self.emails: return True, f"אימייל '{email}' כבר קיים."
+        return False, ""
+
+    def flag_frame(self, df):
+        """סיבות הכפילות לכל שורה ב-df, מול האינדקס ובתוך df עצמו ("" אם אין), בלי לולאה על השורות."""
+        names, phones, emails = supplier_dup_keys(df)
+        has_name, has_phone, has_email = names.ne(''), phones.ne(''), emails.ne('')
+        checks = [(has_name & names.isin(self.names), "שם קיים"),
+                  (has_phone & phones.isin(self.phones), "טלפון קיים"),
+                  (has_email & emails.isin(self.emails), "אימייל קיים"),
+                  ((has_name & names.duplicated(keep=False)) | (has_phone & phones.duplicated(keep=False))
+                   | (has_email & emails.duplicated(keep=False)), "כפול בתוך הרשימה")]
+        flags = pd.Series("", index=df.index, dtype=object)
+        for mask, label in checks: flags = flags + np.where(mask, label + ", ", "")
+        return flags.str.rstrip(", ")
+
+def check_duplicate_supplier(df, name, phone, email, index=None):
+    if index is None:
+        if df.empty: return False, ""
+        index = SupplierIndex(df)
+    return index.find_duplicate(name, phone, email)
+
+def validate_supplier_form(df, name, fields, phone, email, addr, pay, files_dict, index=None):
     if not (name and fields and phone and email and addr and pay):
         return False, "נא למלא את כל שדות החובה (פרטי ספק)"
     
@@ -85,53 +289,570 @@ def validate_supplier_form(df, name, fields, phone, email, addr, pay, files_dict
     if not is_valid_email(email):
         return False, "כתובת אימייל לא תקינה"
     
-    is_dup, msg = check_duplicate_supplier(df, name, phone, email)
+    is_dup, msg = check_duplicate_supplier(df, name, phone, email, index=index)
     if is_dup:
         return False, msg
     return True, ""
 
+# --- חיפוש ---
+# אינדקס מילים ו-trigrams שנבנה פעם אחת לכל גרסה של גיליון הספקים. הנרמול מתעלם
+# מניקוד, מאותיות סופיות, מגרשיים ומסימני פיסוק במספרי טלפון.
+SEARCH_COLUMNS = ['שם הספק', 'טלפון', 'אימייל', 'שם איש קשר', 'כתובת']
+_NIQQUD_RE = re.compile(r'[\u0591-\u05C7]')
+_QUOTES_RE = re.compile(r'[\'"`׳״]')
+_PHONE_TERM_RE = re.compile(r'^[\d\-\s\(\)\+]+$')
+_HEBREW_FINALS = str.maketrans("ךםןףץ", "כמנפצ")
+
+def normalize_search_text(text):
+    if text is None: return ""
+    text = _NIQQUD_RE.sub('', str(text))
+    text = _QUOTES_RE.sub('', text)
+    return " ".join(text.translate(_HEBREW_FINALS).lower().split())
+
+def _search_terms(query):
+    terms = []
+    for t in normalize_search_text(query).split():
+        if _PHONE_TERM_RE.match(t) and re.search(r'\d', t): t = re.sub(r'\D', '', t)
+        if t: terms.append(t)
+    return terms
+
+def _trigrams(text):
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+class SupplierSearchIndex:
+    def __init__(self, df):
+        self.size = len(df)
+        self._blobs = [""] * self.size
+        self._tokens = {}
+        self._grams = {}
+        if df.empty: return
+        cols = [df[c].tolist() if c in df.columns else [""] * self.size for c in SEARCH_COLUMNS]
+        phone_digits = [re.sub(r'\D', '', str(p)) for p in cols[SEARCH_COLUMNS.index('טלפון')]]
+        for i, values in enumerate(zip(*cols, phone_digits)):
+            blob = " ".join(normalize_search_text(v) for v in values)
+            self._blobs[i] = blob
+            for tok in set(blob.split()):
+                self._tokens.setdefault(tok, set()).add(i)
+                for g in _trigrams(tok):
+                    self._grams.setdefault(g, set()).add(i)
+
+    def _match_term(self, term):
+        if len(term) < 3:
+            # מונח קצר: מעבר על אוצר המילים (קטן בהרבה ממספר השורות) במקום על כל השורות
+            rows = set()
+            for tok, ids in self._tokens.items():
+                if term in tok: rows |= ids
+            return rows
+        postings = sorted((self._grams.get(g, set()) for g in _trigrams(term)), key=len)
+        rows = set(postings[0])
+        for p in postings[1:]:
+            if not rows: break
+            rows &= p
+        return {i for i in rows if term in self._blobs[i]}
+
+    def search(self, query):
+        """מחזיר מערך ממוין של מיקומי השורות (iloc) שמכילות את כל מילות החיפוש."""
+        rows = None
+        for term in _search_terms(query):
+            hits = self._match_term(term)
+            rows = hits if rows is None else rows & hits
+            if not rows: break
+        if rows is None: return np.arange(self.size)
+        return np.array(sorted(rows), dtype=np.int64)
+
+# --- אינדקס תחומים ---
+# "תחום עיסוק" נשמר כמחרוזת מופרדת בפסיקים. כל ערך שונה מפורק פעם אחת לתחומים, ולכל ספק
+# נשמרת שורה במטריצה בוליאנית (ספקים × תחומים). סינון AND/OR וספירות הם פעולות על עמודות
+# המטריצה, והתאמה היא לתחום שלם ("חשמל" לא תופס את "חשמל רכב").
+class CategoryIndex:
+    def __init__(self, df):
+        col = df['תחום עיסוק'] if 'תחום עיסוק' in df.columns else pd.Series([""] * len(df))
+        codes, uniques = pd.factorize(col)
+        parsed = [{t.strip() for t in str(u).split(',')} - {""} for u in uniques]
+        self.categories = sorted(set().union(*parsed)) if parsed else []
+        self._col = {c: i for i, c in enumerate(self.categories)}
+        # שורה אחרונה (כולה False) עבור ערכים חסרים, שהקוד שלהם הוא 1-
+        combos = np.zeros((len(uniques) + 1, len(self.categories)), dtype=bool)
+        for k, cats in enumerate(parsed): combos[k, [self._col[c] for c in cats]] = True
+        self.size = len(df)
+        self._bitmap = combos[codes]
+
+    def mask(self, selected, match_all=False):
+        """מסכה בוליאנית באורך הגיליון: ספקים עם כל התחומים שנבחרו (match_all) או עם אחד מהם."""
+        if not selected: return np.ones(self.size, dtype=bool)
+        cols = [self._col[c] for c in selected if c in self._col]
+        if match_all and len(cols) < len(selected): return np.zeros(self.size, dtype=bool)
+        sub = self._bitmap[:, cols]
+        return sub.all(axis=1) if match_all else sub.any(axis=1)
+
+    def counts(self, rows=None):
+        """{תחום: מספר ספקים} מתוך המיקומים rows (ברירת מחדל: כל הגיליון)."""
+        bitmap = self._bitmap if rows is None else self._bitmap[rows]
+        return dict(zip(self.categories, bitmap.sum(axis=0).tolist()))
+
+# --- כפילויות קרובות ---
+# שמות מנורמלים (ניקוד, גרשיים, אותיות סופיות, רווחים וסיומות כמו בע"מ) מחולקים ל-trigrams,
+# ולכל ספק נבנית חתימת MinHash. ספקים שחולקים "פס" שלם בחתימה (LSH) הם מועמדים, וטלפון/אימייל
+# זהים הם בלוקים נוספים - כך שמשווים רק מועמדים ולא כל זוג. כל מועמד מקבל ציון דמיון.
+NEAR_DUP_THRESHOLD = 0.85
+MINHASH_BANDS, MINHASH_ROWS = 10, 3
+_MINHASH_PRIME = (1 << 31) - 1
+_MINHASH_RNG = np.random.default_rng(20240601)
+_MINHASH_A = _MINHASH_RNG.integers(1, _MINHASH_PRIME, MINHASH_BANDS * MINHASH_ROWS, dtype=np.int64)
+_MINHASH_B = _MINHASH_RNG.integers(0, _MINHASH_PRIME, MINHASH_BANDS * MINHASH_ROWS, dtype=np.int64)
+_BAND_MULT = _MINHASH_RNG.integers(1, 1 << 61, MINHASH_ROWS, dtype=np.int64).astype(np.uint64)
+LEGAL_SUFFIXES = {'בעמ', 'בע', 'מ', 'ושות', 'ושותפים', 'ובניו', 'ltd', 'inc', 'llc', 'co'}
+_NON_WORD_RE = re.compile(r'[^\w]+')
+_NON_DIGIT_RE = re.compile(r'\D')
+
+def supplier_name_key(name):
+    """מפתח השוואה לשם ספק: בלי סיומות משפטיות, סימנים ורווחים ("כהן-הנדסה בע"מ" -> "כהנהנדסה")."""
+    tokens = _NON_WORD_RE.sub(' ', normalize_search_text(name)).split()
+    kept = [t for t in tokens if t not in LEGAL_SUFFIXES]
+    return "".join(kept or tokens)
+
+def _name_grams(key):
+    return _trigrams(key) or ({key} if key else set())
+
+def _minhash_bands(keys, chunk=5000):
+    """מערך (מספר שמות, MINHASH_BANDS) של מפתחות פסים. שם ריק מקבל 0 ולא נכנס לדליים."""
+    out = np.zeros((len(keys), MINHASH_BANDS), dtype=np.uint64)
+    for start in range(0, len(keys), chunk):
+        grams = [_name_grams(k) for k in keys[start:start + chunk]]
+        rows = [i for i, g in enumerate(grams) if g]
+        if not rows: continue
+        hashes = np.fromiter((zlib.crc32(g.encode()) % _MINHASH_PRIME for i in rows for g in grams[i]), dtype=np.int64)
+        offsets = np.cumsum([0] + [len(grams[i]) for i in rows[:-1]])
+        sig = np.minimum.reduceat((np.outer(hashes, _MINHASH_A) + _MINHASH_B) % _MINHASH_PRIME, offsets, axis=0)
+        bands = sig.astype(np.uint64).reshape(len(rows), MINHASH_BANDS, MINHASH_ROWS)
+        out[start + np.array(rows)] = (bands * _BAND_MULT).sum(axis=2) | np.uint64(1)
+    return out
+
+def _clean_phone(phone):
+    p = normalize_phone(phone)
+    return p if len(p) >= 7 else ""
+
+class NearDuplicateIndex:
+    """אינדקס כפילויות קרובות לגיליון ספקים. find לספק בודד, scan לסריקת גיליון שלם."""
+
+    def __init__(self, df):
+        col = lambda c: df[c].astype(str).tolist() if c in df.columns else [""] * len(df)
+        self.names = col('שם הספק')
+        self.keys = [supplier_name_key(n) for n in self.names]
+        self.phones = [_clean_phone(p) for p in col('טלפון')]
+        self.emails = [normalize_text(e) for e in col('אימייל')]
+        self.bands = _minhash_bands(self.keys)
+        self._buckets = {}
+        for i, row in enumerate(self.bands.tolist()):
+            for b, h in enumerate(row):
+                if h: self._buckets.setdefault((b, h), []).append(i)
+        self._by_phone, self._by_email = {}, {}
+        for i, (p, e) in enumerate(zip(self.phones, self.emails)):
+            if p: self._by_phone.setdefault(p, []).append(i)
+            if e: self._by_email.setdefault(e, []).append(i)
+
+    def _candidates(self, bands, phone, email):
+        cands = set(self._by_phone.get(phone, ())) | set(self._by_email.get(email, ()))
+        for b, h in enumerate(bands):
+            if h: cands.update(self._buckets.get((b, h), ()))
+        return cands
+
+    def score(self, key, phone, email, j, matcher=None):
+        """(ציון 0-1, סיבות) בין ספק מנורמל לשורה j באינדקס. matcher: SequenceMatcher שה-seq2 שלו כבר key."""
+        score, reasons = 0.0, []
+        if phone and phone == self.phones[j]: score, reasons = 1.0, reasons + ["טלפון"]
+        if email and email == self.emails[j]: score, reasons = 1.0, reasons + ["אימייל"]
+        other = self.keys[j]
+        # שמות שנבדלים רק במספר ("סניף 1" / "סניף 2") הם ספקים שונים
+        if key and other and _NON_DIGIT_RE.sub('', key) == _NON_DIGIT_RE.sub('', other):
+            if matcher is None: matcher = difflib.SequenceMatcher(None, b=key, autojunk=False)
+            matcher.set_seq1(other)
+            if matcher.real_quick_ratio() >= NEAR_DUP_THRESHOLD and matcher.quick_ratio() >= NEAR_DUP_THRESHOLD:
+                sim = matcher.ratio()
+                if sim >= NEAR_DUP_THRESHOLD: score, reasons = max(score, sim), reasons + [f"שם {sim:.0%}"]
+        return score, reasons
+
+    def find(self, name, phone, email, limit=5):
+        """ספקים דומים לספק אחד: רשימת (מיקום iloc, ציון, סיבות) מהגבוה לנמוך."""
+        key, phone, email = supplier_name_key(name), _clean_phone(phone), normalize_text(email)
+        matches, matcher = [], difflib.SequenceMatcher(None, b=key, autojunk=False)
+        for j in self._candidates(_minhash_bands([key])[0].tolist(), phone, email):
+            score, reasons = self.score(key, phone, email, j, matcher)
+            if reasons: matches.append((j, round(score, 3), reasons))
+        return sorted(matches, key=lambda m: -m[1])[:limit]
+
+    def scan(self, df=None):
+        """
+        זוגות דומים: df מול האינדקס, או (כש-df=None) האינדקס מול עצמו, כל זוג פעם אחת.
+        מחזיר DataFrame עם מיקומי השורות, השמות, הציון והסיבות.
+        """
+        if df is None: other, i_range = self, range(len(self.keys))
+        else: other, i_range = NearDuplicateIndex(df), range(len(df))
+        pairs = []
+        for i in i_range:
+            key, phone, email = other.keys[i], other.phones[i], other.emails[i]
+            matcher = difflib.SequenceMatcher(None, b=key, autojunk=False)
+            for j in self._candidates(other.bands[i].tolist(), phone, email):
+                if df is None and j <= i: continue
+                score, reasons = self.score(key, phone, email, j, matcher)
+                if reasons: pairs.append((i, j, other.names[i], self.names[j], round(score, 3), ", ".join(reasons)))
+        result = pd.DataFrame(pairs, columns=['row', 'match_row', 'שם הספק', 'ספק דומה', 'ציון', 'סיבה'])
+        return result.sort_values('ציון', ascending=False, ignore_index=True)
+
+IMPORT_COLUMNS = ['שם הספק', 'תחום עיסוק', 'טלפון', 'אימייל', 'כתובת', 'שם איש קשר', 'תנאי תשלום']
+IMPORT_READ_BLOCK = 5000
+IMPORT_CHUNK_SIZE = 500
+
 def generate_excel_template():
-    columns = ['שם הספק', 'תחום עיסוק', 'טלפון', 'אימייל', 'כתובת', 'שם איש קשר', 'תנאי תשלום']
-    df = pd.DataFrame(columns=columns)
+    df = pd.DataFrame(columns=IMPORT_COLUMNS)
     buffer = io.BytesIO()
     with pd.ExcelWriter(buffer, engine='openpyxl') as writer:
         df.to_excel(writer, index=False, sheet_name='Sheet1')
     return buffer
 
+def _cell_to_str(value):
+    if value is None: return ""
+    if isinstance(value, float) and value.is_integer(): value = int(value)
+    return str(value).strip()
+
+def iter_excel_blocks(file_obj, block_size=IMPORT_READ_BLOCK):
+    """
+    קורא את הגיליון הראשון במצב read-only (זרימה) ומחזיר בלוקים של DataFrame
+    שהאינדקס שלהם הוא מספר השורה באקסל. הערך הראשון שמוחזר הוא רשימת הכותרות.
+    """
+    from openpyxl import load_workbook
+    wb = load_workbook(file_obj, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = [_cell_to_str(h) for h in next(rows, ())]
+        yield header
+        block, row_nums = [], []
+        for n, r in enumerate(rows, start=2):
+            if not any(v is not None and str(v).strip() for v in r): continue
+            block.append([_cell_to_str(v) for v in r[:len(header)]] + [""] * (len(header) - len(r)))
+            row_nums.append(n)
+            if len(block) >= block_size:
+                yield pd.DataFrame(block, columns=header, index=row_nums)
+                block, row_nums = [], []
+        if block: yield pd.DataFrame(block, columns=header, index=row_nums)
+    finally:
+        wb.close()
+
+def prepare_import(file_obj, index, added_by):
+    """
+    בדיקת קובץ יבוא בבלוקים וקטוריים: שדות חובה, כפילויות בתוך הקובץ וכפילויות מול הספקים הקיימים.
+    מחזיר (שורות תקינות בסדר עמודות הגיליון, שגיאות, אזהרות).
+    """
+    blocks = iter_excel_blocks(file_obj)
+    header = next(blocks)
+    missing = [c for c in IMPORT_COLUMNS if c not in header]
+    if missing: return [], [f"כותרות חסרות: {', '.join(missing)}"], []
+
+    valid, errors, warnings = [], [], []
+    seen_names, seen_phones, seen_emails = set(), set(), set()
+    for block in blocks:
+        row_nums = block.index
+        names, phones, emails = supplier_dup_keys(block)
+
+        no_name = (block['שם הספק'] == '').to_numpy()
+        exists = (names.isin(index.names) | (phones.ne('') & phones.isin(index.phones))
+                  | (emails.ne('') & emails.isin(index.emails))).to_numpy()
+        in_file = (names.isin(seen_names) | names.duplicated()
+                   | (phones.ne('') & (phones.isin(seen_phones) | phones.duplicated()))
+                   | (emails.ne('') & (emails.isin(seen_emails) | emails.duplicated()))).to_numpy()
+        seen_names.update(names); seen_phones.update(phones); seen_emails.update(emails)
+
+        errors += [f"שורה {n}: חסר שם" for n in row_nums[no_name]]
+        warnings += [f"שורה {n}: ספק כבר קיים במערכת - דולג" for n in row_nums[~no_name & exists]]
+        warnings += [f"שורה {n}: כפול בתוך הקובץ - דולג" for n in row_nums[~no_name & ~exists & in_file]]
+        ok = block[~no_name & ~exists & ~in_file].copy()
+        ok['נוסף על ידי'] = added_by
+        valid += ok.reindex(columns=SUPPLIER_COLUMNS[:8], fill_value='').values.tolist()
+    return valid, errors, warnings
+
+# --- ייצוא ---
+# הקובץ נכתב בבלוקים: openpyxl במצב write-only שומר שורות לקובץ זמני ולא מחזיק את כל הגיליון
+# בזיכרון, ו-CSV נכתב בלוק אחרי בלוק. התוצאה נשמרת לפי גרסת הנתונים והסינון (get_export_cache).
+EXPORT_BLOCK = 2000
+EXPORT_HEADERS = {'link_agreement': 'הסכם חתום', 'link_bank': 'אישור בנק', 'link_tax_books': 'אישור ניכוי מס',
+                  'link_books': 'אישור ניהול ספרים', 'link_invoice': 'דוגמת חשבונית'}
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+def _export_blocks(df):
+    cols = [c for c in SUPPLIER_COLUMNS if c in df.columns]
+    for start in range(0, len(df), EXPORT_BLOCK):
+        yield df.iloc[start:start + EXPORT_BLOCK][cols].astype(object).fillna("").astype(str)
+
+def export_suppliers_xlsx(df):
+    from openpyxl import Workbook
+    from openpyxl.cell import WriteOnlyCell
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("ספקים")
+    ws.sheet_view.rightToLeft = True
+    cols = [c for c in SUPPLIER_COLUMNS if c in df.columns]
+    ws.append([EXPORT_HEADERS.get(c, c) for c in cols])
+    links = [i for i, c in enumerate(cols) if c in EXPORT_HEADERS]
+    for block in _export_blocks(df):
+        for row in block.itertuples(index=False, name=None):
+            # תא ריק לא נכתב בכלל (קובץ קטן ומהיר יותר)
+            row = [v or None for v in row]
+            for i in links:
+                if row[i] and row[i].startswith('http'):
+                    cell = WriteOnlyCell(ws, value=row[i])
+                    cell.hyperlink = row[i]
+                    row[i] = cell
+            ws.append(row)
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    return buffer.getvalue()
+
+def export_suppliers_csv(df):
+    # utf-8-sig כדי שאקסל יזהה את העברית
+    buffer = io.BytesIO()
+    text = io.TextIOWrapper(buffer, encoding='utf-8-sig', newline='')
+    for n, block in enumerate(_export_blocks(df)):
+        block.rename(columns=EXPORT_HEADERS).to_csv(text, index=False, header=n == 0)
+    if df.empty: pd.DataFrame(columns=[EXPORT_HEADERS.get(c, c) for c in SUPPLIER_COLUMNS]).to_csv(text, index=False)
+    text.flush()
+    return text.detach().getvalue()
+
+EXPORTERS = {'xlsx': export_suppliers_xlsx, 'csv': export_suppliers_csv}
+
 # --- 4. פונקציות גוגל (דרייב + שיטס) ---
 
 def get_credentials_dict():
     return dict(st.secrets["gcp_service_account"])
 
-def get_client():
+# --- שער גישה ל-Google ---
+# כל קריאה ל-Sheets/Drive עוברת דרך GoogleGateway: דלי אסימונים לפי מכסת הדקה,
+# ניסיון חוזר עם המתנה מעריכית על 429/5xx, ואיחוד קריאות זהות שכבר בדרך.
+SHEETS_READS_PER_MINUTE = int(os.environ.get("SHEETS_READS_PER_MINUTE", 60))
+SHEETS_WRITES_PER_MINUTE = int(os.environ.get("SHEETS_WRITES_PER_MINUTE", 60))
+DRIVE_REQUESTS_PER_MINUTE = int(os.environ.get("DRIVE_REQUESTS_PER_MINUTE", 1200))
+RETRY_ATTEMPTS = 5
+RETRY_MAX_DELAY = 32
+RETRYABLE_STATUS = {429, 500, 502, 503, 504}
+CHANGE_TOKEN_TTL = 5
+
+class TokenBucket:
+    def __init__(self, per_minute):
+        self.per_minute = per_minute
+        self.capacity = float(per_minute)
+        self._tokens = float(per_minute)
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """לוקח אסימון (ממתין אם צריך) ומחזיר את זמן ההמתנה בשניות."""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.per_minute / 60)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return waited
+                delay = (1 - self._tokens) * 60 / self.per_minute
+            time.sleep(delay)
+            waited += delay
+
+def _http_status(error):
+    response = getattr(error, 'response', None)
+    if response is not None and getattr(response, 'status_code', None): return response.status_code
+    resp = getattr(error, 'resp', None)
+    if resp is not None and getattr(resp, 'status', None): return int(resp.status)
+    return None
+
+def _transport_errors():
+    """תקלות רשת: של requests (gspread), של httplib2 (googleapiclient) ושל socket."""
+    errors = [ConnectionError, TimeoutError, socket.gaierror]
     try:
-        creds = ServiceAccountCredentials.from_json_keyfile_dict(get_credentials_dict(), SCOPE)
-        client = gspread.authorize(creds)
-        return client
-    except Exception as e:
-        st.error("שגיאת התחברות ל-Google Sheets")
-        return None
+        from requests.exceptions import ConnectionError as RequestsConnectionError, Timeout
+        errors += [RequestsConnectionError, Timeout]
+    except ImportError: pass
+    try:
+        from httplib2 import HttpLib2Error
+        errors.append(HttpLib2Error)
+    except ImportError: pass
+    return tuple(errors)
+
+def is_ambiguous_failure(error):
+    """5xx או תקלת רשת: לא ידוע אם הבקשה בוצעה בשרת."""
+    return _http_status(error) in RETRYABLE_STATUS - {429} or isinstance(error, _transport_errors())
 
-def upload_file_to_drive(file_obj, filename_prefix):
+def _is_retryable(error, idempotent=True):
+    # 429 פירושו שהבקשה נדחתה ולא בוצעה. אחרי כשל עמום, כתיבה שאינה אידמפוטנטית
+    # (הוספת שורות, מחיקה לפי מספר שורה) הייתה עלולה להתבצע פעמיים, ולכן לא נשלחת שוב
+    if _http_status(error) == 429: return True
+    return idempotent and is_ambiguous_failure(error)
+
+class GoogleGateway:
+    def __init__(self):
+        self.buckets = {
+            'sheets_read': TokenBucket(SHEETS_READS_PER_MINUTE),
+            'sheets_write': TokenBucket(SHEETS_WRITES_PER_MINUTE),
+            'drive': TokenBucket(DRIVE_REQUESTS_PER_MINUTE),
+        }
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self._recent = {k: deque() for k in self.buckets}
+        self.stats = {k: {'calls': 0, 'retries': 0, 'errors': 0, 'coalesced': 0, 'throttled_seconds': 0.0}
+                      for k in self.buckets}
+
+    def call(self, kind, fn, *args, key=None, idempotent=True, **kwargs):
+        """
+        מריץ קריאה ל-Google דרך מגביל הקצב. kind: 'sheets_read' / 'sheets_write' / 'drive'.
+        קריאות עם אותו key שמגיעות בזמן שקריאה זהה עדיין רצה מקבלות את אותה תוצאה.
+        idempotent=False: ניסיון חוזר רק כשברור שהבקשה לא בוצעה (429).
+        """
+        if key is None: return self._execute(kind, fn, *args, idempotent=idempotent, **kwargs)
+        with self._lock:
+            future = self._inflight.get(key)
+            owner = future is None
+            if owner: future = self._inflight[key] = Future()
+            else: self.stats[kind]['coalesced'] += 1
+        if not owner: return future.result()
+        try:
+            result = self._execute(kind, fn, *args, idempotent=idempotent, **kwargs)
+            future.set_result(result)
+            return result
+        except Exception as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._lock: self._inflight.pop(key, None)
+
+    def _execute(self, kind, fn, *args, idempotent=True, **kwargs):
+        stats = self.stats[kind]
+        for attempt in range(RETRY_ATTEMPTS):
+            waited = self.buckets[kind].acquire()
+            with self._lock:
+                stats['calls'] += 1
+                stats['throttled_seconds'] += waited
+                self._recent[kind].append(time.monotonic())
+            try:
+                with perf_span(kind, getattr(fn, '__name__', str(fn)), attempt=attempt, throttled_ms=round(waited * 1000, 1)):
+                    return fn(*args, **kwargs)
+            except Exception as e:
+                if attempt == RETRY_ATTEMPTS - 1 or not _is_retryable(e, idempotent):
+                    with self._lock: stats['errors'] += 1
+                    logging.error(f"Google {kind} call failed: {e}")
+                    raise
+                with self._lock: stats['retries'] += 1
+                delay = min(RETRY_MAX_DELAY, 2 ** attempt) + random.random()
+                logging.warning(f"Google {kind} call failed ({_http_status(e)}), retrying in {delay:.1f}s")
+                time.sleep(delay)
+
+    def usage(self):
+        """קריאות בדקה האחרונה מול המכסה, לכל סוג."""
+        cutoff = time.monotonic() - 60
+        report = {}
+        with self._lock:
+            for kind, recent in self._recent.items():
+                while recent and recent[0] < cutoff: recent.popleft()
+                report[kind] = dict(self.stats[kind], last_minute=len(recent), limit=self.buckets[kind].per_minute)
+        return report
+
+@st.cache_resource
+def get_gateway():
+    return GoogleGateway()
+
+@st.cache_resource
+def get_drive_discovery():
+    """מסמך ה-discovery של Drive v3 מהעותק שמגיע עם googleapiclient, פעם אחת לתהליך ובלי בקשת רשת."""
+    from googleapiclient.discovery_cache import get_static_doc
+    return get_static_doc('drive', 'v3')
+
+class GoogleConnection:
     """
-    מעלה קובץ ל-Google Drive ומחזיר את הקישור אליו.
+    חיבור משותף לכל התהליך: הרשאה אחת, גיליון פתוח אחד ושירות Drive אחד.
+    הטוקן מתחדש אוטומטית (google-auth) ולכן אין צורך להתחבר מחדש בכל ריצה.
     """
+
+    def __init__(self, gateway):
+        import gspread
+        from google.oauth2.service_account import Credentials
+        self.gateway = gateway
+        self.credentials = Credentials.from_service_account_info(get_credentials_dict(), scopes=SCOPE)
+        self.client = gspread.authorize(self.credentials)
+        self._lock = threading.Lock()
+        self._spreadsheet = None
+        self._worksheets = {}
+        self._drive = None
+
+    def spreadsheet(self):
+        with self._lock:
+            if self._spreadsheet is None:
+                self._spreadsheet = self.gateway.call('sheets_read', self.client.open, SHEET_NAME)
+            return self._spreadsheet
+
+    def worksheet(self, worksheet_name):
+        spreadsheet = self.spreadsheet()
+        with self._lock:
+            if worksheet_name not in self._worksheets:
+                self._worksheets[worksheet_name] = self.gateway.call('sheets_read', spreadsheet.worksheet, worksheet_name)
+            return self._worksheets[worksheet_name]
+
+    def drive(self):
+        import httplib2
+        from google_auth_httplib2 import AuthorizedHttp
+        from googleapiclient.discovery import build_from_document
+        from googleapiclient.http import HttpRequest
+        # אובייקט httplib2 אינו בטוח לשימוש ממספר תהליכונים, לכן כל בקשה מקבלת Http משלה
+        def build_request(http, *args, **kwargs):
+            return HttpRequest(AuthorizedHttp(self.credentials, http=httplib2.Http()), *args, **kwargs)
+        with self._lock:
+            if self._drive is None:
+                self._drive = build_from_document(get_drive_discovery(), credentials=self.credentials,
+                                                  requestBuilder=build_request)
+            return self._drive
+
+    def reset(self):
+        """שחרור הידיות השמורות (למשל אחרי שינוי מבנה בגיליון)."""
+        with self._lock:
+            self._spreadsheet = None
+            self._worksheets = {}
+
+@st.cache_resource
+def get_google_connection():
+    with perf_span('auth', 'google connect'):
+        return GoogleConnection(get_gateway())
+
+UPLOAD_WORKERS = 8
+RESUMABLE_THRESHOLD = 5 * 1024 * 1024
+UPLOAD_CHUNK_SIZE = 5 * 1024 * 1024  # חייב להיות כפולה של 256KB
+
+@st.cache_resource
+def get_upload_pool():
+    # מאגר תהליכונים משותף לכל הסשנים, כדי להגביל את מספר ההעלאות המקבילות בתהליך
+    return ThreadPoolExecutor(max_workers=UPLOAD_WORKERS, thread_name_prefix="drive-upload")
+
+def _upload_to_drive(service, gateway, file_obj, filename_prefix):
     if not file_obj: return ""
     try:
-        creds = ServiceAccountCredentials.from_json_keyfile_dict(get_credentials_dict(), SCOPE)
-        service = build('drive', 'v3', credentials=creds)
-        
         file_name = f"{filename_prefix}_{file_obj.name}"
         file_metadata = {'name': file_name}
         
         file_obj.seek(0)
-        media = MediaIoBaseUpload(file_obj, mimetype=file_obj.type)
+        size = getattr(file_obj, 'size', None)
+        resumable = size is None or size > RESUMABLE_THRESHOLD
+        from googleapiclient.http import MediaIoBaseUpload
+        media = MediaIoBaseUpload(file_obj, mimetype=file_obj.type, chunksize=UPLOAD_CHUNK_SIZE, resumable=resumable)
         
-        file = service.files().create(
+        request = service.files().create(
             body=file_metadata,
             media_body=media,
             fields='id, webViewLink'
-        ).execute()
+        )
+        if resumable:
+            # העלאה בגושים; גוש שנכשל נשלח שוב דרך השער בלי להתחיל מההתחלה
+            file = None
+            while file is None:
+                _, file = gateway.call('drive', request.next_chunk)
+        else:
+            # יצירת קובץ אינה אידמפוטנטית: אחרי כשל עמום שליחה חוזרת הייתה יוצרת עותק נוסף
+            file = gateway.call('drive', request.execute, idempotent=False)
         
         return file.get('webViewLink')
         
@@ -139,108 +860,943 @@ def upload_file_to_drive(file_obj, filename_prefix):
         logging.error(f"Drive Upload Error: {e}")
         return None
 
-@st.cache_data(ttl=300)
+def upload_files_to_drive(uploads):
+    """
+    מעלה כמה קבצים במקביל. uploads: רשימת (קובץ, קידומת).
+    מחזיר את הקישורים באותו סדר (None לקובץ שנכשל).
+    """
+    try:
+        service = get_google_connection().drive()
+    except Exception as e:
+        logging.error(f"Drive Upload Error: {e}")
+        return [None] * len(uploads)
+    pool, gateway = get_upload_pool(), get_gateway()
+    with perf_span('drive', 'upload batch', files=len(uploads)):
+        futures = [pool.submit(_upload_to_drive, service, gateway, f, prefix) for f, prefix in uploads]
+        return [f.result() for f in futures]
+
+# --- 5. שכבת אחסון ---
+# כל הגישה לגיליונות עוברת דרך StorageBackend, כך שאפשר להחליף את Google Sheets
+# במאגר SQLite מקומי (או בזיכרון, עם SQLITE_PATH=":memory:") בלי לגעת בממשק.
+# מספרי שורות הם בסגנון גיליון: שורה 1 היא הכותרות, הרשומה הראשונה היא שורה 2.
+
+def merge_row_ranges(row_numbers):
+    """מאחד מספרי שורות (או עמודות) לטווחים רציפים (start, end) כולל, מהתחתון לעליון."""
+    ranges = []
+    for n in sorted(set(row_numbers), reverse=True):
+        if ranges and ranges[-1][0] == n + 1: ranges[-1][0] = n
+        else: ranges.append([n, n])
+    return [tuple(r) for r in ranges]
+
+def match_key_rows(column_values, keys):
+    """מספרי השורות (מ-2) של המופע הראשון של כל מפתח ב-keys (מפתח שחוזר פעמיים מוחק שני מופעים)."""
+    wanted = {}
+    for k in keys:
+        k = str(k).strip()
+        wanted[k] = wanted.get(k, 0) + 1
+    rows = []
+    for n, v in enumerate(column_values, start=2):
+        v = str(v).strip()
+        if wanted.get(v, 0) > 0:
+            wanted[v] -= 1
+            rows.append(n)
+    return rows
+
+class StorageBackend:
+    def get_records(self, worksheet_name):
+        raise NotImplementedError
+
+    def append_rows(self, worksheet_name, rows):
+        raise NotImplementedError
+
+    def delete_rows(self, worksheet_name, row_numbers):
+        raise NotImplementedError
+
+    def update_cells(self, worksheet_name, row_number, values):
+        """values: מילון {מספר עמודה (מ-1): ערך}"""
+        raise NotImplementedError
+
+    def update_rows(self, worksheet_name, updates):
+        """עדכון כמה שורות בבקשה אחת. updates: מילון {מספר שורה: {מספר עמודה: ערך}}"""
+        for row_number, values in updates.items():
+            self.update_cells(worksheet_name, row_number, values)
+
+    def read_cell(self, worksheet_name, row_number, col):
+        raise NotImplementedError
+
+    def change_token(self, fresh=False):
+        """ערך זול שמשתנה בכל שינוי בנתונים (None = לא ידוע, תמיד לבדוק). fresh: בלי ערך שמור."""
+        return None
+
+    def get_many_records(self, worksheet_names):
+        """{גיליון: רשומות} לכמה גיליונות יחד."""
+        return {ws: self.get_records(ws) for ws in worksheet_names}
+
+    def apply_batch(self, ops):
+        """
+        מחיל רשימת פעולות כיחידה אחת. כל פעולה היא מילון:
+        {'op': 'append', 'worksheet', 'rows'} או {'op': 'delete', 'worksheet', 'key_col', 'key_index', 'keys'}.
+        מחיקות נפתרות לפי הסדר (מופע ראשון לכל מפתח מבין השורות שעוד לא נמחקו) ומתבצעות לפני ההוספות.
+        """
+        for op in ops:
+            if op['op'] == 'delete':
+                data = self.get_records(op['worksheet'])
+                keys = [str(row[op['key_col']]).strip() for row in data]
+                self.delete_rows(op['worksheet'], match_key_rows(keys, op['keys']))
+        for op in ops:
+            if op['op'] == 'append': self.append_rows(op['worksheet'], op['rows'])
+
+    def replace_values(self, worksheet_name, values):
+        """מחליף את כל תוכן הגיליון. values[0] היא שורת הכותרות."""
+        raise NotImplementedError
+
+def _records_from_values(values):
+    from gspread.utils import numericise_all, to_records
+    if not values or not values[0]: return []
+    width = max(len(r) for r in values)
+    padded = [list(r) + [""] * (width - len(r)) for r in values]
+    return to_records(padded[0], [numericise_all(r) for r in padded[1:]])
+
+class SheetsStorage(StorageBackend):
+    def __init__(self, gateway):
+        self.gateway = gateway
+        self._token = None
+        self._token_checked_at = float('-inf')
+
+    def _worksheet(self, worksheet_name):
+        return get_google_connection().worksheet(worksheet_name)
+
+    def _read(self, fn, *args, key=None, **kwargs):
+        return self.gateway.call('sheets_read', fn, *args, key=key, **kwargs)
+
+    def _write(self, fn, *args, idempotent=True, **kwargs):
+        return self.gateway.call('sheets_write', fn, *args, idempotent=idempotent, **kwargs)
+
+    def get_records(self, worksheet_name):
+        return self._read(self._worksheet(worksheet_name).get_all_records, key=('records', worksheet_name))
+
+    def append_rows(self, worksheet_name, rows):
+        self._write(self._worksheet(worksheet_name).append_rows, rows, idempotent=False)
+
+    def delete_rows(self, worksheet_name, row_numbers):
+        if not row_numbers: return
+        sheet = self._worksheet(worksheet_name)
+        # בקשה אחת לכל המחיקות; טווחים רציפים מאוחדים ונמחקים מלמטה למעלה כדי שהאינדקסים לא יזוזו
+        requests = [{"deleteDimension": {"range": {"sheetId": sheet.id, "dimension": "ROWS",
+                                                   "startIndex": start - 1, "endIndex": end}}}
+                    for start, end in merge_row_ranges(row_numbers)]
+        self._write(sheet.spreadsheet.batch_update, {"requests": requests}, idempotent=False)
+
+    def update_cells(self, worksheet_name, row_number, values):
+        self.update_rows(worksheet_name, {row_number: values})
+
+    def update_rows(self, worksheet_name, updates):
+        from gspread.utils import rowcol_to_a1
+        # עמודות רציפות באותה שורה נכתבות כטווח אחד, וכל הטווחים נשלחים בבקשה אחת
+        data = []
+        for row, values in updates.items():
+            for start, end in reversed(merge_row_ranges(values)):
+                data.append({'range': f"{rowcol_to_a1(row, start)}:{rowcol_to_a1(row, end)}",
+                             'values': [[values[c] for c in range(start, end + 1)]]})
+        if data: self._write(self._worksheet(worksheet_name).batch_update, data)
+
+    def read_cell(self, worksheet_name, row_number, col):
+        return self._read(self._worksheet(worksheet_name).cell, row_number, col,
+                          key=('cell', worksheet_name, row_number, col)).value
+
+    def change_token(self, fresh=False):
+        # זמן השינוי של קובץ הגיליון ב-Drive; בקשה אחת מכסה את כל הגיליונות ונשמרת לכמה שניות
+        now = time.monotonic()
+        if not fresh and now - self._token_checked_at < CHANGE_TOKEN_TTL: return self._token
+        conn = get_google_connection()
+        meta = self.gateway.call('drive', conn.drive().files().get(fileId=conn.spreadsheet().id, fields='modifiedTime').execute,
+                                 key=('modifiedTime',))
+        self._token, self._token_checked_at = meta.get('modifiedTime'), now
+        return self._token
+
+    def get_many_records(self, worksheet_names):
+        # בקשת values_batch_get אחת לכל הגיליונות, ופענוח כמו get_all_records
+        ranges = [f"'{ws}'" for ws in worksheet_names]
+        value_ranges = self._read(get_google_connection().spreadsheet().values_batch_get, ranges,
+                                  key=('batch', tuple(worksheet_names))).get('valueRanges', [])
+        return {ws: _records_from_values(vr.get('values', [])) for ws, vr in zip(worksheet_names, value_ranges)}
+
+    def apply_batch(self, ops):
+        from gspread.utils import rowcol_to_a1
+        # קריאה אחת של עמודות המפתח בלבד, ואחריה batch_update אחד עם כל המחיקות וההוספות
+        conn = get_google_connection()
+        spreadsheet = conn.spreadsheet()
+        deletes = [op for op in ops if op['op'] == 'delete']
+        requests = []
+        if deletes:
+            ranges = [f"'{op['worksheet']}'!{rowcol_to_a1(1, op['key_index'])[:-1]}2:{rowcol_to_a1(1, op['key_index'])[:-1]}"
+                      for op in deletes]
+            columns = self._read(spreadsheet.values_batch_get, ranges).get('valueRanges', [])
+            rows_by_ws = {}
+            for op, col in zip(deletes, columns):
+                values = [r[0] if r else "" for r in col.get('values', [])]
+                # כל פעולה נפתרת מול השורות שעוד לא נבחרו למחיקה באצווה (כמו ב-cache_drop_rows),
+                # כך ששתי מחיקות של אותו מפתח מוחקות שני מופעים ולא את אותה שורה פעמיים
+                taken = rows_by_ws.setdefault(op['worksheet'], set())
+                free = [n for n in range(2, len(values) + 2) if n not in taken]
+                taken.update(free[i - 2] for i in match_key_rows([values[n - 2] for n in free], op['keys']))
+            for ws, rows in rows_by_ws.items():
+                sheet_id = conn.worksheet(ws).id
+                requests += [{"deleteDimension": {"range": {"sheetId": sheet_id, "dimension": "ROWS",
+                                                            "startIndex": start - 1, "endIndex": end}}}
+                             for start, end in merge_row_ranges(rows)]
+        for op in ops:
+            if op['op'] != 'append': continue
+            rows = [{"values": [{"userEnteredValue": {"stringValue": "" if v is None else str(v)}} for v in r]}
+                    for r in op['rows']]
+            requests.append({"appendCells": {"sheetId": conn.worksheet(op['worksheet']).id, "rows": rows,
+                                             "fields": "userEnteredValue"}})
+        if requests: self._write(spreadsheet.batch_update, {"requests": requests}, idempotent=False)
+
+    def replace_values(self, worksheet_name, values):
+        sheet = self._worksheet(worksheet_name)
+        self._write(sheet.clear)
+        self._write(sheet.update, values)
+
+class SQLiteStorage(StorageBackend):
+    """מאגר מקומי עם אותם גיליונות ואותן כותרות כמו ב-Google Sheets."""
+
+    def __init__(self, path=SQLITE_PATH):
+        self._path = path
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.RLock()
+        with self._lock, self._conn:
+            for ws, headers in WORKSHEET_HEADERS.items():
+                cols = ", ".join(f'"{h}" TEXT' for h in headers)
+                self._conn.execute(f'CREATE TABLE IF NOT EXISTS "{ws}" (_row INTEGER PRIMARY KEY, {cols})')
+
+    def _headers(self, worksheet_name):
+        if worksheet_name not in WORKSHEET_HEADERS: raise KeyError(f"Unknown worksheet: {worksheet_name}")
+        return WORKSHEET_HEADERS[worksheet_name]
+
+    def _row_ids(self, worksheet_name):
+        return [r[0] for r in self._conn.execute(f'SELECT _row FROM "{worksheet_name}" ORDER BY _row')]
+
+    def _fit(self, headers, row):
+        row = ["" if v is None else str(v) for v in row][:len(headers)]
+        return row + [""] * (len(headers) - len(row))
+
+    def get_records(self, worksheet_name):
+        headers = self._headers(worksheet_name)
+        cols = ", ".join(f'"{h}"' for h in headers)
+        with self._lock:
+            rows = self._conn.execute(f'SELECT {cols} FROM "{worksheet_name}" ORDER BY _row').fetchall()
+        return [dict(zip(headers, r)) for r in rows]
+
+    def append_rows(self, worksheet_name, rows):
+        headers = self._headers(worksheet_name)
+        cols = ", ".join(f'"{h}"' for h in headers)
+        marks = ", ".join("?" * len(headers))
+        with self._lock, self._conn:
+            self._conn.executemany(f'INSERT INTO "{worksheet_name}" ({cols}) VALUES ({marks})',
+                                   [self._fit(headers, r) for r in rows])
+
+    def delete_rows(self, worksheet_name, row_numbers):
+        self._headers(worksheet_name)
+        with self._lock, self._conn:
+            ids = self._row_ids(worksheet_name)
+            doomed = [(ids[n - 2],) for n in set(row_numbers) if 2 <= n < len(ids) + 2]
+            self._conn.executemany(f'DELETE FROM "{worksheet_name}" WHERE _row = ?', doomed)
+
+    def update_cells(self, worksheet_name, row_number, values):
+        self.update_rows(worksheet_name, {row_number: values})
+
+    def update_rows(self, worksheet_name, updates):
+        headers = self._headers(worksheet_name)
+        with self._lock, self._conn:
+            ids = self._row_ids(worksheet_name)
+            for row_number, values in updates.items():
+                if not 2 <= row_number < len(ids) + 2: raise IndexError(f"Row {row_number} out of range")
+                sets = ", ".join(f'"{headers[c - 1]}" = ?' for c in values)
+                self._conn.execute(f'UPDATE "{worksheet_name}" SET {sets} WHERE _row = ?',
+                                   ["" if v is None else str(v) for v in values.values()] + [ids[row_number - 2]])
+
+    def apply_batch(self, ops):
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                for op in ops:
+                    if op['op'] != 'delete': continue
+                    ws = op['worksheet']
+                    rows = self._conn.execute(f'SELECT _row, "{op["key_col"]}" FROM "{ws}" ORDER BY _row').fetchall()
+                    doomed = match_key_rows([r[1] for r in rows], op['keys'])
+                    self._conn.executemany(f'DELETE FROM "{ws}" WHERE _row = ?', [(rows[n - 2][0],) for n in doomed])
+                for op in ops:
+                    if op['op'] != 'append': continue
+                    headers = self._headers(op['worksheet'])
+                    cols = ", ".join(f'"{h}"' for h in headers)
+                    self._conn.executemany(f'INSERT INTO "{op["worksheet"]}" ({cols}) VALUES ({", ".join("?" * len(headers))})',
+                                           [self._fit(headers, r) for r in op['rows']])
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def change_token(self, fresh=False):
+        with self._lock:
+            mtime = os.path.getmtime(self._path) if os.path.exists(self._path) else None
+            return (self._conn.total_changes, mtime)
+
+    def read_cell(self, worksheet_name, row_number, col):
+        headers = self._headers(worksheet_name)
+        with self._lock:
+            ids = self._row_ids(worksheet_name)
+            if not 2 <= row_number < len(ids) + 2: return None
+            return self._conn.execute(f'SELECT "{headers[col - 1]}" FROM "{worksheet_name}" WHERE _row = ?',
+                                      (ids[row_number - 2],)).fetchone()[0]
+
+    def replace_values(self, worksheet_name, values):
+        headers = self._headers(worksheet_name)
+        with self._lock, self._conn:
+            self._conn.execute(f'DELETE FROM "{worksheet_name}"')
+        if len(values) > 1:
+            pos = {h: i for i, h in enumerate(values[0])}
+            self.append_rows(worksheet_name, [[r[pos[h]] if h in pos and pos[h] < len(r) else "" for h in headers] for r in values[1:]])
+
+@st.cache_resource
+def get_storage():
+    if STORAGE_BACKEND == "sqlite": return SQLiteStorage(SQLITE_PATH)
+    return SheetsStorage(get_gateway())
+
+# --- 6. מטמון גיליונות ---
+# מטמון משותף לכל הסשנים, עם רשומה וגרסה נפרדות לכל גיליון. כתיבה מעדכנת רק את
+# הגיליון שנגע בה (הוספה/מחיקה/עדכון ישירות על ה-DataFrame השמור), ולכן אין צורך
+# לטעון מחדש את כל הגיליונות אחרי כל פעולה.
+# כשפג תוקף הבדיקה (CACHE_TTL) נבדק קודם אם הקובץ השתנה בכלל (בקשה זולה אחת); אם לא, הנתונים
+# השמורים ממשיכים לשמש. טעינה מלאה כשהקובץ השתנה, או פעם ב-FULL_RELOAD_INTERVAL ליתר ביטחון.
+# האסימון משתנה גם בכתיבות של האפליקציה עצמה (למשל שמירת הנוכחות פעם בדקה). כתיבות כאלה
+# עוברות דרך own_write: הן כבר מוחלות על המטמון, ולכן רשומות שהיו עדכניות לפניהן מקבלות את
+# האסימון החדש ולא נטענות מחדש.
+CACHE_TTL = 60
+FULL_RELOAD_INTERVAL = 1800
+
+# כל גרסה של גיליון נשמרת כתמונת מצב אחת שכל הסשנים חולקים. עמודות עם מעט ערכים שונים
+# נשמרות כ-category והשאר כמחרוזות (str) במקום object. ב-pandas 3 כל DataFrame הוא
+# copy-on-write, ולכן אפשר למסור את תמונת המצב (ותצוגות מסוננות שלה) ישירות: שינוי בסשן
+# אחד יוצר עותק פרטי ולא נוגע בתמונה המשותפת. לכן requirements.txt דורש pandas>=3.
+COMPACT_CATEGORIES = {
+    "suppliers": ['תחום עיסוק', 'תנאי תשלום', 'נוסף על ידי'],
+    "pending_suppliers": ['תחום עיסוק', 'תנאי תשלום', 'נוסף על ידי'],
+    "rejected_suppliers": ['תחום עיסוק', 'תנאי תשלום', 'נוסף על ידי'],
+    "users": ['role'],
+}
+
+def compact_frame(worksheet_name, df):
+    if df.empty: return df
+    cats = COMPACT_CATEGORIES.get(worksheet_name, ())
+    dtypes = {}
+    for c, dtype in df.dtypes.items():
+        if c in cats:
+            if not isinstance(dtype, pd.CategoricalDtype): dtypes[c] = 'category'
+        elif dtype != 'str': dtypes[c] = 'str'
+    if not dtypes: return df
+    # ערכים מספריים (Sheets ממיר "0521234567" למספר) הופכים למחרוזת לפני המרה ל-category
+    return df.astype({c: 'str' for c in dtypes}).astype({c: t for c, t in dtypes.items() if t == 'category'})
+
+def column_contains(series, text):
+    """מסכת "מכיל את text" (ללא regex). בעמודת category נבדקים רק הערכים השונים ולא כל השורות."""
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        hits = series.cat.categories.astype(str).str.contains(text, regex=False)
+        return pd.Series(np.append(hits, False)[series.cat.codes], index=series.index)
+    return series.astype(str).str.contains(text, regex=False, na=False)
+
+class WorksheetCache:
+    def __init__(self, ttl=CACHE_TTL):
+        self.ttl = ttl
+        self._lock = threading.RLock()
+        self._entries = {}
+        self._versions = {}
+        self._derived = {}
+
+    def version(self, worksheet_name):
+        with self._lock:
+            return self._versions.get(worksheet_name, 0)
+
+    def _bump(self, worksheet_name):
+        self._versions[worksheet_name] = self._versions.get(worksheet_name, 0) + 1
+
+    def get(self, worksheet_name, loader):
+        return self._get_versioned(worksheet_name, loader)[0]
+
+    def _get_versioned(self, worksheet_name, loader):
+        with self._lock:
+            entry = self._entries.get(worksheet_name)
+            version = self._versions.get(worksheet_name, 0)
+            if entry and time.time() - entry['loaded_at'] < self.ttl:
+                perf_event('cache', f"{worksheet_name} hit")
+                return entry['df'], version
+            previous = entry if entry and time.time() - entry['full_at'] < FULL_RELOAD_INTERVAL else None
+        with perf_span('cache', f"{worksheet_name} {'sync' if previous else 'miss'}"):
+            df, token, full = loader(worksheet_name, previous)
+        with self._lock:
+            # אם הייתה כתיבה בזמן הטעינה, הנתונים שנטענו כבר לא עדכניים ולא נשמרים
+            if self._versions.get(worksheet_name, 0) == version:
+                now = time.time()
+                if previous is not None and df is previous['df']:
+                    previous.update(loaded_at=now, token=token)
+                else:
+                    df = compact_frame(worksheet_name, df)
+                    self._entries[worksheet_name] = {'df': df, 'loaded_at': now, 'token': token,
+                                                     'full_at': now if full else previous['full_at']}
+                    self._bump(worksheet_name)
+                    version = self._versions[worksheet_name]
+        return df, version
+
+    def prefetch(self, worksheet_names, bulk_loader):
+        """
+        טוען יחד את כל הגיליונות שאינם במטמון או שפג תוקף הבדיקה שלהם. bulk_loader מקבל
+        {גיליון: רשומה קודמת או None} ומחזיר רק את הגיליונות שהשתנו; השאר ממשיכים לשמש.
+        """
+        with self._lock:
+            now = time.time()
+            due = {}
+            for ws in worksheet_names:
+                entry = self._entries.get(ws)
+                if entry and now - entry['loaded_at'] < self.ttl: continue
+                due[ws] = entry if entry and now - entry['full_at'] < FULL_RELOAD_INTERVAL else None
+            versions = {ws: self._versions.get(ws, 0) for ws in due}
+        if not due: return
+        with perf_span('cache', f"{','.join(due)} prefetch"):
+            frames, token = bulk_loader(due)
+        with self._lock:
+            now = time.time()
+            for ws, previous in due.items():
+                if self._versions.get(ws, 0) != versions[ws]: continue
+                if ws in frames:
+                    self._entries[ws] = {'df': compact_frame(ws, frames[ws]), 'loaded_at': now, 'token': token, 'full_at': now}
+                    self._bump(ws)
+                elif previous is not None:
+                    previous.update(loaded_at=now, token=token)
+
+    @contextmanager
+    def own_write(self, storage):
+        """
+        עוטף כתיבה של האפליקציה (שמעדכנת גם את המטמון). אם האסימון לפני הכתיבה תאם לרשומה,
+        הרשומה מקבלת את האסימון שאחרי הכתיבה. שינוי חיצוני שקדם לכתיבה עדיין יגרום לטעינה.
+        """
+        before = self._fresh_token(storage)
+        yield
+        after = self._fresh_token(storage)
+        if before is None or after is None or before == after: return
+        with self._lock:
+            for entry in self._entries.values():
+                if entry['token'] == before: entry['token'] = after
+
+    @staticmethod
+    def _fresh_token(storage):
+        try: return storage.change_token(fresh=True)
+        except Exception as e:
+            logging.error(f"Change token check failed: {e}")
+            return None
+
+    def derived(self, worksheet_name, key, builder, loader):
+        """מבנה נגזר (אינדקס וכו') שנבנה פעם אחת לכל גרסה של הגיליון."""
+        df, version = self._get_versioned(worksheet_name, loader)
+        with self._lock:
+            hit = self._derived.get((worksheet_name, key))
+            if hit and hit[0] == version: return hit[1]
+        with perf_span('index', f"{worksheet_name} {key}"):
+            value = builder(df)
+        with self._lock:
+            self._derived[(worksheet_name, key)] = (version, value)
+        return value
+
+    def derived_for(self, worksheet_name, key, builder, df):
+        """מבנה נגזר עבור df: השמור אם df הוא תמונת המצב הנוכחית של הגיליון, אחרת נבנה זמני שלא נשמר."""
+        with self._lock:
+            entry = self._entries.get(worksheet_name)
+            current = entry is not None and entry['df'] is df
+            version = self._versions.get(worksheet_name, 0)
+            hit = self._derived.get((worksheet_name, key))
+            if current and hit and hit[0] == version: return hit[1]
+        with perf_span('index', f"{worksheet_name} {key}"):
+            value = builder(df)
+        if current:
+            with self._lock:
+                if self._versions.get(worksheet_name, 0) == version: self._derived[(worksheet_name, key)] = (version, value)
+        return value
+
+    def patch(self, worksheet_name, fn):
+        """מחיל fn על ה-DataFrame השמור. אם fn מחזירה None הרשומה נמחקת ותיטען מחדש."""
+        with self._lock:
+            entry = self._entries.get(worksheet_name)
+            self._bump(worksheet_name)
+            if not entry: return
+            try: new_df = fn(entry['df'])
+            except Exception as e:
+                logging.error(f"Cache patch failed for {worksheet_name}: {e}")
+                new_df = None
+            if new_df is None: del self._entries[worksheet_name]
+            else: entry['df'] = compact_frame(worksheet_name, new_df)
+
+    def invalidate(self, worksheet_name=None):
+        with self._lock:
+            names = [worksheet_name] if worksheet_name else list(self._entries)
+            for ws in names:
+                self._entries.pop(ws, None)
+                self._bump(ws)
+
+@st.cache_resource
+def get_worksheet_cache():
+    return WorksheetCache()
+
+class LRUCache:
+    """מטמון קטן ומוגבל בגודל (הפריט שלא נגעו בו הכי הרבה זמן יוצא ראשון)."""
+
+    def __init__(self, maxsize=256):
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+
+    def get(self, key):
+        with self._lock:
+            if key not in self._items: return None
+            self._items.move_to_end(key)
+            return self._items[key]
+
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = value
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize: self._items.popitem(last=False)
+
+@st.cache_resource
+def get_html_cache():
+    return LRUCache(maxsize=256)
+
+@st.cache_resource
+def get_export_cache():
+    # קבצים גדולים - שומרים רק את האחרונים
+    return LRUCache(maxsize=8)
+
+def cached_export(df, key, fmt):
+    """קובץ הייצוא של df, פעם אחת לכל (גרסה, סינון, פורמט)."""
+    data = get_export_cache().get((key, fmt))
+    if data is None:
+        with perf_span('export', f"suppliers {fmt}", rows=len(df)):
+            data = EXPORTERS[fmt](df)
+        get_export_cache().put((key, fmt), data)
+    return data
+
+def _load_worksheet(worksheet_name, previous=None):
+    """מחזיר (DataFrame, אסימון שינוי, האם נטען במלואו)."""
+    # כתיבות שעוד בתור היו נדרסות בטעינה מחדש, לכן ממתינים להן קודם
+    get_write_queue().wait_for(worksheet_name)
+    storage = get_storage()
+    token = storage.change_token()
+    # האסימון מכסה את כל הקובץ ולא מגלה אילו טווחים השתנו, ולכן כל שינוי (גם עריכה במקום) מחייב טעינה מלאה
+    if previous is not None and token is not None and token == previous['token']: return previous['df'], token, False
+    return pd.DataFrame(storage.get_records(worksheet_name)), token, True
+
+def _load_worksheets(previous):
+    """previous: {גיליון: רשומה קודמת או None}. מחזיר ({גיליון: DataFrame} לגיליונות שנטענו, אסימון שינוי)."""
+    for ws in previous: get_write_queue().wait_for(ws)
+    storage = get_storage()
+    token = storage.change_token()
+    stale = [ws for ws, entry in previous.items() if entry is None or token is None or token != entry['token']]
+    if not stale: return {}, token
+    records = storage.get_many_records(stale)
+    return {ws: pd.DataFrame(records.get(ws, [])) for ws in stale}, token
+
+def prefetch_worksheets(worksheet_names):
+    """טעינת כל הגיליונות שהדף צריך ושהשתנו בבקשה אחת (במקום בקשה לכל גיליון)."""
+    try: get_worksheet_cache().prefetch(worksheet_names, _load_worksheets)
+    except Exception as e: logging.error(f"Prefetching {worksheet_names} failed: {e}")
+
 def get_worksheet_data(worksheet_name):
+    """תמונת המצב המשותפת של הגיליון, בלי העתקה (copy-on-write מגן עליה משינויים)."""
     try:
-        creds = ServiceAccountCredentials.from_json_keyfile_dict(get_credentials_dict(), SCOPE)
-        client = gspread.authorize(creds)
-        sheet = client.open(SHEET_NAME).worksheet(worksheet_name)
-        data = sheet.get_all_records()
-        return pd.DataFrame(data)
-    except Exception:
+        return get_worksheet_cache().get(worksheet_name, _load_worksheet)
+    except Exception as e:
+        logging.error(f"Loading worksheet {worksheet_name} failed: {e}")
         return pd.DataFrame()
 
-def _get_sheet_object(worksheet_name):
-    try:
-        client = get_client()
-        return client.open(SHEET_NAME).worksheet(worksheet_name)
-    except: return None
+def get_supplier_index(worksheet_name="suppliers"):
+    try: return get_worksheet_cache().derived(worksheet_name, 'dup_index', SupplierIndex, _load_worksheet)
+    except Exception: return SupplierIndex(pd.DataFrame())
+
+def get_near_dup_index():
+    try: return get_worksheet_cache().derived("suppliers", 'near_dup_index', NearDuplicateIndex, _load_worksheet)
+    except Exception: return NearDuplicateIndex(pd.DataFrame())
+
+def get_search_index(df):
+    return get_worksheet_cache().derived_for("suppliers", 'search_index', SupplierSearchIndex, df)
+
+def get_category_index(df):
+    return get_worksheet_cache().derived_for("suppliers", 'category_index', CategoryIndex, df)
+
+def search_positions(df, query):
+    """מיקומי השורות (iloc) ב-df שמתאימות לחיפוש, בעזרת האינדקס השמור (או אינדקס זמני אם df אינו הגרסה השמורה)."""
+    if not normalize_search_text(query): return np.arange(len(df))
+    return get_search_index(df).search(query)
+
+def filter_suppliers(df, query, categories=(), match_all=False):
+    """(df מסונן לפי חיפוש ותחומים, ספירת הספקים לכל תחום מתוך תוצאות החיפוש)."""
+    rows = search_positions(df, query)
+    index = get_category_index(df)
+    counts = index.counts(rows)
+    if categories: rows = rows[index.mask(categories, match_all)[rows]]
+    return df.iloc[rows], counts
+
+def _build_user_records(df):
+    if df.empty or 'username' not in df.columns: return {}
+    records = df.assign(_norm=df['username'].astype(str).str.lower().str.strip()).drop_duplicates('_norm')
+    return {r['_norm']: r for r in records.to_dict('records')}
+
+def get_user_record(username):
+    """רשומת המשתמש (מילון) לפי אימייל מנורמל, מתוך אינדקס שנבנה פעם אחת לכל גרסה."""
+    try: records = get_worksheet_cache().derived("users", 'records', _build_user_records, _load_worksheet)
+    except Exception: return None
+    return records.get(normalize_text(username))
+
+def _build_username_set(df):
+    if df.empty or 'username' not in df.columns: return frozenset()
+    return frozenset(df['username'].astype(str).str.lower().str.strip())
+
+def get_usernames(worksheet_name="users"):
+    try: return get_worksheet_cache().derived(worksheet_name, 'usernames', _build_username_set, _load_worksheet)
+    except Exception: return frozenset()
+
+def _key_mask(df, key_col, key_val, case_insensitive=False):
+    col = df[key_col].astype(str).str.strip()
+    val = str(key_val).strip()
+    if case_insensitive: return col.str.lower() == val.lower()
+    return col == val
+
+def cache_append_rows(worksheet_name, rows):
+    def apply(df):
+        if df.empty and len(df.columns) == 0: return None
+        width = len(df.columns)
+        fitted = [list(r)[:width] + [''] * (width - len(r)) for r in rows]
+        return pd.concat([df, pd.DataFrame(fitted, columns=df.columns)], ignore_index=True)
+    get_worksheet_cache().patch(worksheet_name, apply)
+
+def cache_drop_row(worksheet_name, key_col, key_val, case_insensitive=False):
+    def apply(df):
+        hits = df.index[_key_mask(df, key_col, key_val, case_insensitive)]
+        if len(hits) == 0: return df
+        return df.drop(hits[:1]).reset_index(drop=True)
+    get_worksheet_cache().patch(worksheet_name, apply)
+
+def cache_drop_rows(worksheet_name, key_col, key_vals):
+    def apply(df):
+        remaining = {}
+        for v in key_vals:
+            k = str(v).strip()
+            remaining[k] = remaining.get(k, 0) + 1
+        drop = []
+        for idx, k in zip(df.index, df[key_col].astype(str).str.strip()):
+            if remaining.get(k, 0) > 0:
+                remaining[k] -= 1
+                drop.append(idx)
+        return df.drop(drop).reset_index(drop=True)
+    get_worksheet_cache().patch(worksheet_name, apply)
+
+def cache_update_row(worksheet_name, key_col, key_val, values, case_insensitive=False):
+    """values: מילון {מספר עמודה (מ-1): ערך}, כמו ב-StorageBackend.update_cells"""
+    def apply(df):
+        hits = df.index[_key_mask(df, key_col, key_val, case_insensitive)]
+        if len(hits) == 0: return df
+        df = df.copy()
+        for col, val in values.items():
+            name = df.columns[col - 1]
+            # ערך חדש לא תמיד קיים בקטגוריות; compact_frame ימיר חזרה אחרי העדכון
+            if isinstance(df[name].dtype, pd.CategoricalDtype): df[name] = df[name].astype(str)
+            df.loc[hits[0], name] = val
+        return df
+    get_worksheet_cache().patch(worksheet_name, apply)
+
+# --- נוכחות משתמשים ---
+# הנוכחות נשמרת בזיכרון התהליך ונכתבת ל-active_users באצווה אחת פעם בדקה,
+# במקום קריאה וכתיבה של כל הגיליון בכל ריצה של כל משתמש.
+PRESENCE_FLUSH_INTERVAL = 60
+ONLINE_WINDOW = 300
+TS_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+class PresenceRegistry:
+    def __init__(self, flush_interval=PRESENCE_FLUSH_INTERVAL):
+        self.flush_interval = flush_interval
+        self._lock = threading.Lock()
+        self._seen = {}
+        self._dirty = set()
+        self._last_flush = 0.0
+
+    def heartbeat(self, username):
+        user = normalize_text(username)
+        if not user: return None
+        with self._lock:
+            self._seen[user] = datetime.now().replace(microsecond=0)
+            self._dirty.add(user)
+            if time.time() - self._last_flush < self.flush_interval: return None
+            self._last_flush = time.time()
+            batch = {u: self._seen[u] for u in self._dirty}
+            self._dirty.clear()
+        return batch
+
+    def requeue(self, batch):
+        with self._lock: self._dirty.update(batch)
+
+    def snapshot(self):
+        with self._lock: return dict(self._seen)
+
+@st.cache_resource
+def get_presence_registry():
+    return PresenceRegistry()
+
+def _flush_presence(batch):
+    df = get_worksheet_data("active_users")
+    rows = {}
+    if not df.empty:
+        norm = df['username'].astype(str).str.lower().str.strip()
+        rows = dict(zip(norm, range(2, len(df) + 2)))
+    stamps = {u: ts.strftime(TS_FORMAT) for u, ts in batch.items()}
+    updates = {rows[u]: {2: ts} for u, ts in stamps.items() if u in rows}
+    appends = [[u, ts] for u, ts in stamps.items() if u not in rows]
+
+    def apply(cached):
+        if cached.empty: return None
+        cached = cached.copy()
+        cached['last_seen'] = cached['last_seen'].astype(str)
+        for row, values in updates.items(): cached.loc[cached.index[row - 2], 'last_seen'] = values[2]
+        return pd.concat([cached, pd.DataFrame(appends, columns=['username', 'last_seen'])], ignore_index=True)
+    storage, cache = get_storage(), get_worksheet_cache()
+    with cache.own_write(storage):
+        if updates: storage.update_rows("active_users", updates)
+        if appends: storage.append_rows("active_users", appends)
+        cache.patch("active_users", apply)
 
 def update_active_user(username):
-    current_time = datetime.now()
-    if 'last_api_update' in st.session_state:
-        if (current_time - st.session_state['last_api_update']).seconds < 60: return
-    try:
-        sheet = _get_sheet_object("active_users")
-        if not sheet: return
-        data = sheet.get_all_records()
-        df = pd.DataFrame(data)
-        ts_str = current_time.strftime("%Y-%m-%d %H:%M:%S")
-        found = False
-        if not df.empty:
-            for idx, row in df.iterrows():
-                if normalize_text(row['username']) == normalize_text(username):
-                    sheet.update_cell(idx + 2, 2, ts_str)
-                    found = True
-                    break
-        if not found: sheet.append_row([username, ts_str])
-        st.session_state['last_api_update'] = current_time
-    except: pass
+    registry = get_presence_registry()
+    batch = registry.heartbeat(username)
+    if not batch: return
+    try: _flush_presence(batch)
+    except Exception as e:
+        logging.error(f"Presence flush failed: {e}")
+        registry.requeue(batch)
 
 def get_online_users_count_and_names():
     try:
         df_active = get_worksheet_data("active_users")
-        if df_active.empty: return 0, []
+        local = pd.Series(get_presence_registry().snapshot(), dtype='datetime64[ns]')
+        if not df_active.empty:
+            stored = pd.Series(pd.to_datetime(df_active['last_seen'].astype(str), format=TS_FORMAT, errors='coerce').values,
+                               index=df_active['username'].astype(str).str.lower().str.strip())
+            local = pd.concat([stored, local]).groupby(level=0).max()
+        online = local[local >= datetime.now() - pd.Timedelta(seconds=ONLINE_WINDOW)]
+        if online.empty: return 0, []
         df_users = get_worksheet_data("users")
-        now = datetime.now()
-        active_names = []
-        for _, row in df_active.iterrows():
-            try:
-                last_seen = datetime.strptime(str(row['last_seen']), "%Y-%m-%d %H:%M:%S")
-                if (now - last_seen).total_seconds() < 300: 
-                    email = str(row['username']).lower().strip()
-                    display_name = email
-                    if not df_users.empty:
-                        user_row = df_users[df_users['username'].astype(str).str.lower().str.strip() == email]
-                        if not user_row.empty: display_name = user_row.iloc[0]['name']
-                    active_names.append(display_name)
-            except: continue
-        return len(active_names), active_names
-    except: return 0, []
+        names = pd.Series(online.index, index=online.index)
+        if not df_users.empty:
+            display = (df_users.assign(_norm=df_users['username'].astype(str).str.lower().str.strip())
+                       .drop_duplicates('_norm').set_index('_norm')['name'])
+            names = display.reindex(online.index).fillna(names)
+        return len(names), names.astype(str).tolist()
+    except Exception as e:
+        logging.error(f"Online users lookup failed: {e}")
+        return 0, []
 
 def add_row_to_sheet(worksheet_name, row_data):
     try:
-        sheet = _get_sheet_object(worksheet_name)
-        if sheet:
-            sheet.append_row(row_data)
-            st.cache_data.clear()
-            return True
+        storage = get_storage()
+        with get_worksheet_cache().own_write(storage):
+            storage.append_rows(worksheet_name, [row_data])
+            cache_append_rows(worksheet_name, [row_data])
+        return True
     except Exception as e: st.error(f"שגיאה: {e}")
     return False
 
+def _norm_key(value, case_insensitive):
+    key = str(value).strip()
+    return key.lower() if case_insensitive else key
+
+def _build_row_index(key_col, case_insensitive):
+    def build(df):
+        if df.empty or key_col not in df.columns: return {'col': None, 'rows': {}}
+        rows = {}
+        for n, v in enumerate(df[key_col].tolist(), start=2):
+            rows.setdefault(_norm_key(v, case_insensitive), n)
+        return {'col': df.columns.get_loc(key_col) + 1, 'rows': rows}
+    return build
+
+def find_row_number(worksheet_name, key_col, key_val, case_insensitive=False):
+    """
+    מספר השורה בגיליון לפי מפתח, מתוך אינדקס מפתח->שורה שנבנה מהמטמון פעם אחת לכל גרסה
+    (ומתעדכן יחד איתו בהוספה ובמחיקה). לפני שימוש נקרא רק תא המפתח עצמו לאימות;
+    אם הגיליון השתנה מבחוץ המטמון נטען מחדש פעם אחת.
+    """
+    # כתיבות שעוד בתור היו מזיזות שורות אחרי שמספר השורה כבר נקבע
+    get_write_queue().wait_for(worksheet_name)
+    key = _norm_key(key_val, case_insensitive)
+    cache = get_worksheet_cache()
+    for attempt in range(2):
+        index = cache.derived(worksheet_name, ('row_index', key_col, case_insensitive),
+                              _build_row_index(key_col, case_insensitive), _load_worksheet)
+        row = index['rows'].get(key)
+        if row and _norm_key(get_storage().read_cell(worksheet_name, row, index['col']), case_insensitive) == key:
+            return row
+        if attempt == 0: cache.invalidate(worksheet_name)
+    return None
+
 def delete_row_from_sheet(worksheet_name, key_col, key_val):
     try:
-        sheet = _get_sheet_object(worksheet_name)
-        if not sheet: return False
-        data = sheet.get_all_records()
-        for i, row in enumerate(data):
-            if str(row[key_col]).strip() == str(key_val).strip():
-                sheet.delete_rows(i + 2)
-                st.cache_data.clear()
-                return True
+        row = find_row_number(worksheet_name, key_col, key_val)
+        if row:
+            storage = get_storage()
+            with get_worksheet_cache().own_write(storage):
+                storage.delete_rows(worksheet_name, [row])
+                cache_drop_row(worksheet_name, key_col, key_val)
+            return True
     except Exception as e: st.error(f"שגיאה: {e}")
     return False
 
+def delete_rows_from_sheet(worksheet_name, key_col, key_vals):
+    """מחיקה מרובה: קריאה אחת של הגיליון ובקשת מחיקה אחת. מחזיר את מספר השורות שנמחקו."""
+    try:
+        get_write_queue().wait_for(worksheet_name)
+        storage = get_storage()
+        data = storage.get_records(worksheet_name)
+        row_numbers = match_key_rows([row[key_col] for row in data], key_vals)
+        if not row_numbers: return 0
+        with get_worksheet_cache().own_write(storage):
+            storage.delete_rows(worksheet_name, row_numbers)
+            cache_drop_rows(worksheet_name, key_col, key_vals)
+        return len(row_numbers)
+    except Exception as e: st.error(f"שגיאה: {e}")
+    return 0
+
+def run_import_job(job, on_progress=None):
+    """
+    כותב את שורות היבוא בגושים בגודל מכסה. job['done'] נשמר אחרי כל גוש,
+    כך שאחרי כשל אפשר להריץ שוב ולהמשיך מאותה נקודה. אחרי כשל עמום ייתכן שהגוש נשמר בכל זאת,
+    ולכן לפני ההמשך הספקים נטענים מחדש ושורות שכבר קיימות בגיליון יוצאות מהיבוא (job['skipped']).
+    """
+    rows = job['rows']
+    storage, cache = get_storage(), get_worksheet_cache()
+    if job.get('verify'):
+        cache.invalidate("suppliers")
+        index = SupplierIndex(cache.get("suppliers", _load_worksheet))
+        name, phone, email = (SUPPLIER_COLUMNS.index(c) for c in ('שם הספק', 'טלפון', 'אימייל'))
+        remaining = [r for r in rows[job['done']:] if not index.find_duplicate(r[name], r[phone], r[email])[0]]
+        job['skipped'] = job.get('skipped', 0) + len(rows) - job['done'] - len(remaining)
+        rows = job['rows'] = rows[:job['done']] + remaining
+        job['verify'] = False
+    while job['done'] < len(rows):
+        chunk = rows[job['done']:job['done'] + IMPORT_CHUNK_SIZE]
+        try:
+            with cache.own_write(storage):
+                storage.append_rows("suppliers", chunk)
+                cache_append_rows("suppliers", chunk)
+        except Exception as e:
+            job['verify'] = is_ambiguous_failure(e)
+            raise
+        job['done'] += len(chunk)
+        if on_progress: on_progress(job['done'], len(rows))
+
+# --- תור כתיבה ---
+# פעולות שמורכבות מכמה שלבים (אישור = הוספה לגיליון אחד ומחיקה מאחר) נשלחות כאצווה אחת.
+# המטמון מתעדכן מיד והממשק ממשיך; תהליכון רקע מאחד אצוות עוקבות לבקשה אחת.
+# כשל מדווח למשתמש שיזם את הפעולה בריצה הבאה, והגיליונות שנגעו בהם נטענים מחדש.
+WRITE_COALESCE_SECONDS = 0.3
+
+class WriteQueue:
+    def __init__(self, storage, cache):
+        self.storage = storage
+        self.cache = cache
+        self._queue = queue.Queue()
+        self._cond = threading.Condition()
+        self._pending = {}
+        self._failures = {}
+        threading.Thread(target=self._run, name="write-queue", daemon=True).start()
+
+    def submit(self, ops, description, owner=None):
+        with self._cond:
+            for ws in {op['worksheet'] for op in ops}: self._pending[ws] = self._pending.get(ws, 0) + 1
+        self._queue.put({'ops': ops, 'description': description, 'owner': owner})
+
+    def wait_for(self, worksheet_name=None, timeout=30):
+        """ממתין עד שאין כתיבות ממתינות לגיליון (או לאף גיליון)."""
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: not (self._pending.get(worksheet_name) if worksheet_name else any(self._pending.values())),
+                timeout=timeout)
+
+    def pop_failures(self, owner):
+        with self._cond: return self._failures.pop(owner, [])
+
+    def _run(self):
+        while True:
+            items = [self._queue.get()]
+            time.sleep(WRITE_COALESCE_SECONDS)
+            while True:
+                try: items.append(self._queue.get_nowait())
+                except queue.Empty: break
+            try:
+                with self.cache.own_write(self.storage): self.storage.apply_batch([op for item in items for op in item['ops']])
+            except Exception as e:
+                if is_ambiguous_failure(e):
+                    # ייתכן שהאצווה בוצעה, ושליחה חוזרת הייתה מכפילה הוספות/מחיקות; הטעינה מחדש תראה מה נשמר
+                    logging.error(f"Batched write failed, not retrying: {e}")
+                    failed = [(item, e) for item in items]
+                else:
+                    logging.error(f"Batched write failed, retrying items one by one: {e}")
+                    failed = []
+                    for item in items:
+                        try:
+                            with self.cache.own_write(self.storage): self.storage.apply_batch(item['ops'])
+                        except Exception as e2: failed.append((item, e2))
+                for item, err in failed:
+                    logging.error(f"Write failed ({item['description']}): {err}")
+                    with self._cond: self._failures.setdefault(item['owner'], []).append(f"{item['description']}: {err}")
+                    for ws in {op['worksheet'] for op in item['ops']}: self.cache.invalidate(ws)
+            with self._cond:
+                for item in items:
+                    for ws in {op['worksheet'] for op in item['ops']}: self._pending[ws] -= 1
+                self._cond.notify_all()
+
+@st.cache_resource
+def get_write_queue():
+    return WriteQueue(get_storage(), get_worksheet_cache())
+
+def append_op(worksheet_name, rows):
+    return {'op': 'append', 'worksheet': worksheet_name, 'rows': [["" if v is None else str(v) for v in r] for r in rows]}
+
+def delete_op(worksheet_name, key_col, keys):
+    df = get_worksheet_data(worksheet_name)
+    return {'op': 'delete', 'worksheet': worksheet_name, 'key_col': key_col, 'keys': list(keys),
+            'key_index': df.columns.get_loc(key_col) + 1 if key_col in df.columns else 1}
+
+def enqueue_writes(ops, description):
+    """מעדכן את המטמון מיד (פעם אחת לכל גיליון) ושולח את השינויים לתור הכתיבה."""
+    for op in ops:
+        if op['op'] == 'append': cache_append_rows(op['worksheet'], op['rows'])
+        else: cache_drop_rows(op['worksheet'], op['key_col'], op['keys'])
+    get_write_queue().submit(ops, description, owner=st.session_state.get('username'))
+
+def show_write_failures():
+    for msg in get_write_queue().pop_failures(st.session_state.get('username')):
+        st.error(f"שמירה נכשלה: {msg}")
+
 # --- פונקציות ניהול משתמשים ורשימות ---
 def update_user_details(original_email, new_email, new_name, new_role, new_password=None):
     try:
-        sheet = _get_sheet_object("users")
-        if not sheet: return False
-        data = sheet.get_all_records()
-        idx = -1
-        for i, row in enumerate(data):
-            if str(row['username']).lower() == str(original_email).lower():
-                idx = i + 2; break
-        if idx != -1:
-            if new_email: sheet.update_cell(idx, 1, new_email)
-            sheet.update_cell(idx, 3, new_role)
-            sheet.update_cell(idx, 4, new_name)
+        idx = find_row_number("users", 'username', original_email, case_insensitive=True)
+        if idx:
+            values = {3: new_role, 4: new_name}
+            if new_email: values[1] = new_email
             if new_password:
                 h = hash_password(new_password)
-                if h: sheet.update_cell(idx, 2, h)
-            st.cache_data.clear()
+                if h: values[2] = h
+            storage = get_storage()
+            with get_worksheet_cache().own_write(storage):
+                storage.update_rows("users", {idx: values})
+                cache_update_row("users", 'username', original_email, values, case_insensitive=True)
             return True
-    except: pass
+    except Exception as e: st.error(f"שגיאה: {e}")
     return False
 
 def get_settings_lists():
@@ -252,9 +1808,9 @@ def get_settings_lists():
 
 def update_settings_list(column_name, new_list):
     try:
-        sheet = _get_sheet_object("settings")
-        if not sheet: return
-        data = sheet.get_all_records()
+        get_write_queue().wait_for("settings")
+        storage = get_storage()
+        data = storage.get_records("settings")
         df = pd.DataFrame(data)
         other_col = 'payment_terms' if column_name == 'fields' else 'fields'
         other_list = [x for x in df[other_col].tolist() if x] if not df.empty and other_col in df.columns else []
@@ -262,10 +1818,11 @@ def update_settings_list(column_name, new_list):
         new_list += [''] * (max_len - len(new_list))
         other_list += [''] * (max_len - len(other_list))
         new_df = pd.DataFrame({column_name: new_list, other_col: other_list})
-        sheet.clear()
-        sheet.update([new_df.columns.values.tolist()] + new_df.values.tolist())
-        st.cache_data.clear()
-    except: pass
+        cache = get_worksheet_cache()
+        with cache.own_write(storage):
+            storage.replace_values("settings", [new_df.columns.values.tolist()] + new_df.values.tolist())
+            cache.invalidate("settings")
+    except Exception as e: st.error(f"שגיאה: {e}")
 
 # --- CSS ---
 def set_css():
@@ -299,11 +1856,8 @@ def confirm_bulk_delete(suppliers_to_delete):
     st.write(f"האם למחוק **{len(suppliers_to_delete)}** ספקים?")
     col1, col2 = st.columns(2)
     if col1.button("כן, מחק", type="primary"):
-        prog = st.progress(0)
-        cnt = 0
-        for i, name in enumerate(suppliers_to_delete):
-            if delete_row_from_sheet("suppliers", "שם הספק", name): cnt += 1
-            prog.progress((i + 1) / len(suppliers_to_delete))
+        with st.spinner("מוחק..."):
+            cnt = delete_rows_from_sheet("suppliers", "שם הספק", suppliers_to_delete)
         if cnt > 0:
             st.success(f"{cnt} נמחקו!")
             time.sleep(1)
@@ -312,14 +1866,9 @@ def confirm_bulk_delete(suppliers_to_delete):
     if col2.button("ביטול"): st.rerun()
 
 def show_admin_delete_table(df, all_fields_list):
-    c_search, c_filter = st.columns([2, 1])
-    with c_search: search = st.text_input("🔍 חיפוש למחיקה", "")
-    with c_filter: cat = st.selectbox("📂 סינון למחיקה", ["הכל"] + all_fields_list)
+    df, _ = supplier_filter_controls(df, all_fields_list, "🔍 חיפוש למחיקה", "📂 סינון למחיקה")
 
-    if not df.empty:
-        if cat != "הכל": df = df[df['תחום עיסוק'].astype(str).str.contains(cat, na=False)]
-        if search: df = df[df['שם הספק'].astype(str).str.contains(search, case=False, na=False) | df['טלפון'].astype(str).str.contains(search, case=False, na=False)]
-        
+    if not df.empty:        
         cols_order = ['שם הספק', 'תחום עיסוק', 'טלפון', 'אימייל', 'כתובת', 'שם איש קשר', 'תנאי תשלום', 'נוסף על ידי']
         final_cols = [c for c in cols_order if c in df.columns]
         df_disp = df[final_cols].copy()
@@ -361,6 +1910,72 @@ def show_file_links(row):
     if not found:
         st.write("אין מסמכים מצורפים.")
 
+def near_duplicate_gate(name, phone, email):
+    """
+    מחזיר True אם אפשר להמשיך בשמירה. בשליחה הראשונה של ספק שדומה לספקים קיימים מוצגת
+    אזהרה; שליחה חוזרת של אותם פרטים נחשבת לאישור שזה ספק אחר.
+    """
+    index = get_near_dup_index()
+    matches = index.find(name, phone, email)
+    ack = (name, phone, email)
+    if not matches or st.session_state.get('near_dup_ack') == ack: return True
+    st.session_state['near_dup_ack'] = ack
+    lines = "\n".join(f"- {index.names[j]} ({', '.join(reasons)})" for j, _, reasons in matches)
+    st.warning(f"נמצאו ספקים דומים:\n{lines}\n\nאם זה ספק אחר, לחץ שוב לשמירה.")
+    return False
+
+def show_near_duplicate_scan():
+    """סריקת כפילויות קרובות: ספקים ממתינים מול הגיליון, והגיליון מול עצמו."""
+    with st.expander("🧬 סריקת כפילויות קרובות"):
+        cache = get_worksheet_cache()
+        key = (cache.version("suppliers"), cache.version("pending_suppliers"))
+        if st.button("סרוק"):
+            index = get_near_dup_index()
+            df_pend = get_worksheet_data("pending_suppliers")
+            with st.spinner("סורק..."), perf_span('index', 'near duplicate scan'):
+                st.session_state['near_dup_scan'] = (key, index.scan(df_pend) if not df_pend.empty else pd.DataFrame(), index.scan())
+        scan = st.session_state.get('near_dup_scan')
+        if not scan: return
+        if scan[0] != key: st.caption("הנתונים השתנו מאז הסריקה האחרונה.")
+        _, pending, sheet = scan
+        cols = ['שם הספק', 'ספק דומה', 'ציון', 'סיבה']
+        st.write(f"**ממתינים שדומים לספקים קיימים:** {len(pending)}")
+        if len(pending): st.dataframe(pending[cols], hide_index=True, use_container_width=True)
+        st.write(f"**זוגות דומים בגיליון הספקים:** {len(sheet)}")
+        if len(sheet): st.dataframe(sheet[cols], hide_index=True, use_container_width=True)
+
+def supplier_filter_controls(df, all_fields_list, search_label, filter_label):
+    """חיפוש וסינון תחומים (כמה תחומים, AND/OR, עם ספירה לכל תחום). מחזיר (df מסונן, מפתח הסינון)."""
+    c_search, c_filter = st.columns([2, 1])
+    with c_search: search = st.text_input(search_label, "")
+    if df.empty: return df, (search, (), False)
+    filter_key = f"cats_{filter_label}"
+    cats = st.session_state.get(filter_key, [])
+    match_all = st.session_state.get(f"{filter_key}_all") == "כולם"
+    filtered, counts = filter_suppliers(df, search, cats, match_all)
+    options = list(dict.fromkeys(all_fields_list + list(counts)))
+    with c_filter:
+        st.multiselect(filter_label, options, key=filter_key, placeholder="הכל",
+                       format_func=lambda c: f"{c} ({counts.get(c, 0)})")
+        if len(cats) > 1: st.radio("התאמה", ["אחד מהם", "כולם"], horizontal=True, key=f"{filter_key}_all")
+    return filtered, (search, tuple(sorted(cats)), match_all)
+
+SUPPLIERS_PAGE_SIZE = 50
+TABLE_COLUMNS = ['שם הספק', 'תחום עיסוק', 'טלפון', 'אימייל', 'כתובת', 'שם איש קשר', 'תנאי תשלום', 'נוסף על ידי']
+
+def render_suppliers_html(df):
+    """טבלה (דסקטופ) וכרטיסים (מובייל) עבור השורות שב-df - בדרך כלל עמוד אחד בלבד."""
+    n = len(df)
+    v = {c: [html.escape(str(x)) for x in df[c].tolist()] if c in df.columns else [""] * n for c in TABLE_COLUMNS}
+    cols = [c for c in TABLE_COLUMNS if c in df.columns]
+    head = "".join(f"<th>{html.escape(c)}</th>" for c in cols)
+    body = "".join("<tr>" + "".join(f"<td>{v[c][i]}</td>" for c in cols) + "</tr>" for i in range(n))
+    table_html = f'<table class="rtl-table"><thead><tr>{head}</tr></thead><tbody>{body}</tbody></table>'
+    cards_html = "".join(
+        f"""<div class="mobile-card"><details><summary><span>{name} | {field}</span></summary><div class="card-content"><div><strong>📞:</strong> <a href="tel:{phone}">{phone}</a></div><div><strong>✉️:</strong> <a href="mailto:{email}">{email}</a></div><div><strong>📍:</strong> {addr}</div><div><strong>👤:</strong> {contact}</div><div><strong>💳:</strong> {pay}</div><div style="font-size:0.8em;color:#888;margin-top:5px">נוסף ע"י: {added_by}</div></div></details></div>"""
+        for name, field, phone, email, addr, contact, pay, added_by in zip(*(v[c] for c in TABLE_COLUMNS)))
+    return f'<div class="desktop-view">{table_html}</div><div class="mobile-view">{cards_html}</div>'
+
 def show_suppliers_table_readonly(df, all_fields_list, is_admin=False):
     # תצוגה מיוחדת למנהל: חיפוש ופתיחת כרטיס ספק
     if is_admin:
@@ -394,27 +2009,95 @@ def show_suppliers_table_readonly(df, all_fields_list, is_admin=False):
         st.subheader("📋 כל הספקים")
 
     # הטבלה הרגילה (לכולם)
-    c_search, c_filter = st.columns([2, 1])
-    with c_search: search = st.text_input("🔍 חיפוש חופשי בטבלה", "")
-    with c_filter: cat = st.selectbox("📂 סינון", ["הכל"] + all_fields_list)
+    df, filter_key = supplier_filter_controls(df, all_fields_list, "🔍 חיפוש חופשי בטבלה", "📂 סינון")
 
     if not df.empty:
-        if cat != "הכל": df = df[df['תחום עיסוק'].astype(str).str.contains(cat, na=False)]
-        if search: df = df[df['שם הספק'].astype(str).str.contains(search, case=False, na=False) | df['טלפון'].astype(str).str.contains(search, case=False, na=False)]
-        
-        cols = ['שם הספק', 'תחום עיסוק', 'טלפון', 'אימייל', 'כתובת', 'שם איש קשר', 'תנאי תשלום', 'נוסף על ידי']
-        df_final = df[[c for c in cols if c in df.columns]]
-        
-        table_html = df_final.to_html(index=False, classes='rtl-table', border=0, escape=False).replace('\n', '')
-        
-        cards_html_list = []
-        for _, row in df.iterrows():
-            cards_html_list.append(f"""<div class="mobile-card"><details><summary><span>{row['שם הספק']} | {row['תחום עיסוק']}</span></summary><div class="card-content"><div><strong>📞:</strong> <a href="tel:{row['טלפון']}">{row['טלפון']}</a></div><div><strong>✉️:</strong> <a href="mailto:{row.get('אימייל','')}">{row.get('אימייל','')}</a></div><div><strong>📍:</strong> {row['כתובת']}</div><div><strong>👤:</strong> {row.get('שם איש קשר','')}</div><div><strong>💳:</strong> {row.get('תנאי תשלום','')}</div><div style="font-size:0.8em;color:#888;margin-top:5px">נוסף ע"י: {row.get('נוסף על ידי','')}</div></div></details></div>""")
-        cards_html_full = "".join(cards_html_list)
+        total = len(df)
+        pages = max(1, -(-total // SUPPLIERS_PAGE_SIZE))
+        # מעבר לעמוד הראשון בכל שינוי בחיפוש או בסינון
+        if st.session_state.get('sup_filter') != filter_key:
+            st.session_state['sup_filter'] = filter_key
+            st.session_state['sup_page'] = 1
+        st.session_state['sup_page'] = min(st.session_state.get('sup_page', 1), pages)
+        page = st.number_input(f"עמוד (מתוך {pages})", min_value=1, max_value=pages, key='sup_page') if pages > 1 else 1
+        start = (page - 1) * SUPPLIERS_PAGE_SIZE
+        st.caption(f"מציג {min(start + 1, total)}-{min(start + SUPPLIERS_PAGE_SIZE, total)} מתוך {total}")
+
+        version = get_worksheet_cache().version("suppliers")
+        if is_admin:
+            # הקובץ נבנה רק בלחיצה (ב-thread נפרד) ונשמר לפי גרסה וסינון
+            export_key, view = (version, total, filter_key), df
+            c1, c2, _ = st.columns([1, 1, 4])
+            c1.download_button(f"⬇️ Excel ({total})", lambda: cached_export(view, export_key, 'xlsx'), "suppliers.xlsx", XLSX_MIME)
+            c2.download_button(f"⬇️ CSV ({total})", lambda: cached_export(view, export_key, 'csv'), "suppliers.csv", "text/csv")
 
-        st.markdown(f'<div class="desktop-view">{table_html}</div><div class="mobile-view">{cards_html_full}</div>', unsafe_allow_html=True)
+        key = (version, total, filter_key, page)
+        page_html = get_html_cache().get(key)
+        if page_html is None:
+            with perf_span('render', 'suppliers page html', rows=min(SUPPLIERS_PAGE_SIZE, total - start)):
+                page_html = render_suppliers_html(df.iloc[start:start + SUPPLIERS_PAGE_SIZE])
+            get_html_cache().put(key, page_html)
+        else: perf_event('cache', 'suppliers page html hit')
+        st.markdown(page_html, unsafe_allow_html=True)
     else: st.info("אין נתונים")
 
+def selection_grid(df, key):
+    """טבלה עם עמודת בחירה ותיבת "סמן הכל". מחזיר את השורות שנבחרו (אינדקס זהה ל-df)."""
+    select_all = st.checkbox("סמן הכל", key=f"{key}_all")
+    edited = st.data_editor(
+        df.assign(**{"בחר": select_all}),
+        column_config={"בחר": st.column_config.CheckboxColumn("בחר", width="small")},
+        disabled=[c for c in df.columns], hide_index=True, use_container_width=True, key=key)
+    return df[edited["בחר"].to_numpy(dtype=bool)]
+
+def show_pending_suppliers(df_pend):
+    """אישור ודחייה של ספקים ממתינים בטבלה אחת: סימוני כפילויות וקטוריים ומעבר מרוכז בין הגיליונות."""
+    if df_pend.empty: st.info("אין ספקים ממתינים"); return
+    cache = get_worksheet_cache()
+    # הסריקה נשמרת בסשן לכל גרסת ספקים/ממתינים, כדי שריצות חוזרות של הטאב לא יסרקו שוב
+    key = (cache.version("suppliers"), cache.version("pending_suppliers"))
+    saved = st.session_state.get('pending_near_dups')
+    if saved and saved[0] == key and saved[1] is df_pend: near = saved[2]
+    else:
+        near = get_near_dup_index().scan(df_pend)
+        near = near.drop_duplicates('row').set_index('row')['ספק דומה'] if len(near) else pd.Series(dtype=object)
+        st.session_state['pending_near_dups'] = (key, df_pend, near)
+    grid = df_pend[[c for c in ['שם הספק', 'תחום עיסוק', 'טלפון', 'אימייל', 'נוסף על ידי', 'תאריך הגשה'] if c in df_pend.columns]].copy()
+    grid['⚠️ כפילות'] = get_supplier_index().flag_frame(df_pend)
+    grid['דומה ל'] = near.reindex(range(len(df_pend))).fillna("").to_numpy()
+
+    sel = df_pend.loc[selection_grid(grid, f"pend_s_{key[1]}").index]
+    flagged = (grid.loc[sel.index, '⚠️ כפילות'] != "").sum()
+    if flagged: st.warning(f"{flagged} מהספקים המסומנים כבר קיימים במערכת.")
+
+    c1, c2 = st.columns(2)
+    if c1.button(f"אשר מסומנים ✅ ({len(sel)})", disabled=sel.empty):
+        enqueue_writes([append_op("suppliers", sel.reindex(columns=SUPPLIER_COLUMNS, fill_value='').values.tolist()),
+                        delete_op("pending_suppliers", "שם הספק", sel['שם הספק'].tolist())],
+                       f"אישור {len(sel)} ספקים")
+        st.rerun()
+    if c2.button(f"דחה מסומנים ❌ ({len(sel)})", disabled=sel.empty):
+        rej = sel.reindex(columns=WORKSHEET_HEADERS["pending_suppliers"], fill_value='').assign(**{'תאריך דחייה': str(datetime.now())})
+        enqueue_writes([append_op("rejected_suppliers", rej.values.tolist()),
+                        delete_op("pending_suppliers", "שם הספק", sel['שם הספק'].tolist())],
+                       f"דחיית {len(sel)} ספקים")
+        st.rerun()
+
+    with st.expander("🔎 פרטים ומסמכים"):
+        pick = st.selectbox("ספק ממתין:", range(len(df_pend)), format_func=lambda i: df_pend.iloc[i]['שם הספק'])
+        row = df_pend.iloc[pick]
+        c1, c2 = st.columns(2)
+        with c1:
+            st.write(f"**תחום:** {row['תחום עיסוק']}")
+            st.write(f"**טלפון:** {row['טלפון']}")
+            st.write(f"**אימייל:** {row.get('אימייל', '')}")
+        with c2:
+            st.write(f"**כתובת:** {row['כתובת']}")
+            st.write(f"**איש קשר:** {row.get('שם איש קשר', '')}")
+            st.write(f"**תנאי תשלום:** {row['תנאי תשלום']}")
+        st.divider()
+        show_file_links(row)
+
 # --- 8. ממשק ניהול משתמשים (מנהל) ---
 def show_user_management():
     df_users = get_worksheet_data("users")
@@ -425,18 +2108,24 @@ def show_user_management():
     
     with tabs[0]:
         if not df_pending.empty:
-            for idx, row in df_pending.iterrows():
-                with st.expander(f"{row['name']} ({row['username']})"):
-                    st.write(f"בקשה: {row.get('date', 'N/A')}")
-                    c1, c2 = st.columns(2)
-                    if c1.button("אשר", key=f"app_u_{idx}"):
-                        if add_row_to_sheet("users", [row['username'], row['password'], 'user', row['name']]):
-                            delete_row_from_sheet("pending_users", "username", row['username'])
-                            st.success("אושר!")
-                            time.sleep(0.5); st.rerun()
-                    if c2.button("דחה", key=f"rej_u_{idx}"):
-                        delete_row_from_sheet("pending_users", "username", row['username'])
-                        st.rerun()
+            norm = df_pending['username'].astype(str).str.strip().str.lower()
+            grid = df_pending[['name', 'username', 'date']].copy()
+            grid['⚠️'] = (pd.Series("", index=norm.index).mask(norm.duplicated(keep=False), "בקשה כפולה")
+                          .mask(norm.isin(get_usernames("users")), "כבר רשום"))
+            sel = df_pending.loc[selection_grid(grid, f"pend_u_{get_worksheet_cache().version('pending_users')}").index]
+            # משתמש שכבר רשום (או בקשה שחוזרת) לא נוסף פעם שנייה - רק נמחק מהממתינים
+            new = sel[(grid.loc[sel.index, '⚠️'] != "כבר רשום").to_numpy()]
+            new = new[~norm.loc[new.index].duplicated().to_numpy()]
+            c1, c2 = st.columns(2)
+            if c1.button(f"אשר מסומנים ({len(sel)})", disabled=sel.empty):
+                enqueue_writes([append_op("users", new.assign(role='user')[['username', 'password', 'role', 'name']].values.tolist()),
+                                delete_op("pending_users", "username", sel['username'].tolist())],
+                               f"אישור {len(sel)} משתמשים")
+                st.rerun()
+            if c2.button(f"דחה מסומנים ({len(sel)})", disabled=sel.empty):
+                enqueue_writes([delete_op("pending_users", "username", sel['username'].tolist())],
+                               f"דחיית {len(sel)} משתמשים")
+                st.rerun()
         else: st.info("אין ממתינים.")
 
     with tabs[1]:
@@ -469,7 +2158,7 @@ def show_user_management():
             np = st.text_input("סיסמה", type="password")
             if st.form_submit_button("צור משתמש"):
                 if ne and nn and np:
-                    if not df_users.empty and ne in df_users['username'].astype(str).str.lower().str.strip().values:
+                    if ne in get_usernames("users"):
                         st.error("קיים")
                     else:
                         h = hash_password(np)
@@ -479,6 +2168,48 @@ def show_user_management():
                 else: st.error("כל השדות חובה")
 
 # --- 9. דף כניסה רגיל ---
+def start_session(username, rec, remember=False):
+    st.session_state['logged_in'] = True
+    st.session_state['username'] = username
+    st.session_state['name'] = rec['name']
+    st.session_state['role'] = rec['role']
+    if remember: set_session_cookie(make_session_token(username, rec['password']))
+    st.session_state['login_run'] = True
+    update_active_user(username)
+
+def set_session_cookie(token, days=REMEMBER_ME_DAYS):
+    """קובע (או מוחק, עם token ריק) את עוגיית "זכור אותי". נכתבת בסוף הריצה, ב-flush_session_cookie."""
+    st.session_state['session_cookie'] = (token, int(days * 86400))
+
+def flush_session_cookie():
+    # streamlit קורא עוגיות (st.context.cookies) אבל לא כותב אותן, ולכן הכתיבה נעשית ב-JS
+    pending = st.session_state.pop('session_cookie', None)
+    if pending is None: return
+    token, max_age = pending
+    cookie = json.dumps(f"{SESSION_COOKIE}={token}; Max-Age={max_age}; Path=/; SameSite=Strict")
+    st.html(f'<script>document.cookie = {cookie} + (location.protocol === "https:" ? "; Secure" : "");</script>',
+            unsafe_allow_javascript=True)
+
+def restore_session():
+    """כניסה אוטומטית לפי טוקן "זכור אותי" - בלי bcrypt ובלי קריאה נוספת של הגיליון."""
+    # העוגיה נקראת מהבקשה שפתחה את הסשן, ולכן אחרי יציאה היא עדיין נראית כאן עד רענון הדף
+    if st.session_state.get('signed_out'): return False
+    token = st.context.cookies.get(SESSION_COOKIE)
+    if not token: return False
+    parsed = read_session_token(token)
+    rec = get_user_record(parsed[0]) if parsed else None
+    if not rec or not hmac.compare_digest(parsed[1], _password_fingerprint(rec['password'])):
+        st.session_state['signed_out'] = True
+        set_session_cookie("", days=0)
+        return False
+    start_session(parsed[0], rec)
+    return True
+
+def end_session():
+    st.session_state['logged_in'] = False
+    st.session_state['signed_out'] = True
+    set_session_cookie("", days=0)
+
 def login_page():
     c1, c2, c3 = st.columns([1, 1.5, 1])
     with c2:
@@ -494,22 +2225,14 @@ def login_page():
             with st.form("login_form"):
                 user = st.text_input("אימייל").lower().strip()
                 pw = st.text_input("סיסמה", type="password")
-                st.checkbox("זכור אותי")
+                remember = st.checkbox("זכור אותי")
                 if st.form_submit_button("התחבר"):
-                    df_users = get_worksheet_data("users")
-                    if not df_users.empty:
-                        df_users['user_norm'] = df_users['username'].astype(str).str.lower().str.strip()
-                        rec = df_users[df_users['user_norm'] == user]
-                        if not rec.empty and check_password(pw, rec.iloc[0]['password']):
-                            st.session_state['logged_in'] = True
-                            st.session_state['username'] = user
-                            st.session_state['name'] = rec.iloc[0]['name']
-                            st.session_state['role'] = rec.iloc[0]['role']
-                            update_active_user(user)
-                            st.success("מחובר!")
-                            time.sleep(0.5); st.rerun()
-                        else: st.error("פרטים שגויים")
-                    else: st.error("שגיאה בטעינת נתונים")
+                    rec = get_user_record(user)
+                    if rec and verify_password(pw, rec['password']):
+                        start_session(user, rec, remember)
+                        st.success("מחובר!")
+                        time.sleep(0.5); st.rerun()
+                    else: st.error("פרטים שגויים")
 
         with t2:
             with st.form("signup_form"):
@@ -520,12 +2243,7 @@ def login_page():
                     if not is_valid_email(new_email): st.error("אימייל לא תקין")
                     elif not validate_password_strength(new_pass): st.error("סיסמה חלשה (מינימום 6 תווים)")
                     else:
-                        df_u = get_worksheet_data("users")
-                        df_p = get_worksheet_data("pending_users")
-                        exists = False
-                        if not df_u.empty and new_email in df_u['username'].astype(str).str.lower().str.strip().values: exists = True
-                        if not df_p.empty and new_email in df_p['username'].astype(str).str.lower().str.strip().values: exists = True
-                        
+                        exists = new_email in get_usernames("users") or new_email in get_usernames("pending_users")
                         if exists: st.error("משתמש קיים")
                         else:
                             hashed = hash_password(new_pass)
@@ -534,25 +2252,158 @@ def login_page():
                                 st.success("נשלח לאישור")
 
 # --- 10. ראשי ---
+# --- טאבים ---
+ADMIN_TABS = {'suppliers': "📋 רשימת ספקים", 'pending': "⏳ אישור ספקים", 'users': "👥 ניהול משתמשים", 'add': "➕ הוספה",
+              'settings': "⚙️ הגדרות", 'import': "📥 יבוא", 'delete': "🗑️ מחיקת ספקים"}
+USER_TABS = {'search': "🔎 חיפוש", 'suggest': "➕ הצעה"}
+# הגיליונות שכל טאב קורא (נטענים מראש יחד עם הכותרת)
+TAB_SHEETS = {'suppliers': ["suppliers"], 'pending': ["pending_suppliers", "suppliers"], 'users': ["users", "pending_users"],
+              'add': ["suppliers"], 'settings': ["settings"], 'import': ["suppliers"], 'delete': ["suppliers", "pending_suppliers"],
+              'search': ["suppliers"], 'suggest': ["suppliers"]}
+
+@st.cache_data(show_spinner=False)
+def excel_template_bytes():
+    return generate_excel_template().getvalue()
+
+def show_supplier_form(pending):
+    """טופס ספק חדש: מנהל מוסיף ישירות לגיליון, משתמש שולח לאישור."""
+    fields, terms = get_settings_lists()
+    user_name = st.session_state.get('name', 'User')
+    if not pending: st.write("מילוי פרטי ספק חדש:")
+    with st.form("u_a" if pending else "a_add"):
+        s_name = st.text_input("שם *")
+        s_f = st.multiselect("תחום *", fields)
+        s_p = st.text_input("טלפון *")
+        s_e = st.text_input("אימייל *")
+        s_c = st.text_input("איש קשר")
+        s_a = st.text_input("כתובת *")
+        s_pay = st.selectbox("תנאי *", terms)
+        
+        st.markdown("---")
+        st.write("📂 העלאת מסמכים (חובה):")
+        f1 = st.file_uploader("הסכם חתום *", type=['pdf','png','jpg','jpeg'])
+        f2 = st.file_uploader("אישור ניהול חשבון *", type=['pdf','png','jpg','jpeg'])
+        f3_combined = st.file_uploader("אישור ניכוי מס וניהול ספרים *", type=['pdf','png','jpg','jpeg'])
+        f5 = st.file_uploader("דוגמת חשבונית *", type=['pdf','png','jpg','jpeg'])
+
+        if st.form_submit_button("שלח" if pending else "שמור"):
+            files_map = {'agreement': f1, 'bank': f2, 'tax_books': f3_combined, 'invoice': f5}
+            df_supp = get_worksheet_data("suppliers")
+            valid, msg = validate_supplier_form(df_supp, s_name, s_f, s_p, s_e, s_a, s_pay, files_map, index=get_supplier_index())
+            if valid and near_duplicate_gate(s_name, s_p, s_e):
+                with st.spinner("מעלה קבצים ושולח לאישור..." if pending else "מעלה קבצים..."):
+                    l_ag, l_bk, l_tb, l_in = upload_files_to_drive([
+                        (f1, s_name + "_agree"), (f2, s_name + "_bank"),
+                        (f3_combined, s_name + "_taxbooks"), (f5, s_name + "_inv")])
+                    
+                    links = [l_ag, l_bk, l_tb, l_tb, l_in]
+                    
+                    row_data = [s_name, ", ".join(s_f), s_p, s_a, s_pay, s_e, s_c, user_name] + links
+                    if pending:
+                        add_row_to_sheet("pending_suppliers", row_data + [str(datetime.now())])
+                        st.success("נשלח לאישור!")
+                    else:
+                        add_row_to_sheet("suppliers", row_data)
+                        st.success("נוסף בהצלחה!")
+                        time.sleep(1); st.rerun()
+            elif not valid: st.error(msg)
+
+def show_settings_tab():
+    fields, terms = get_settings_lists()
+    c1, c2 = st.columns(2)
+    with c1:
+        nf = st.text_input("תחום חדש")
+        if st.button("הוסף תחום") and nf: fields.append(nf); update_settings_list("fields", fields); st.rerun()
+        rf = st.selectbox("מחק תחום", [""]+fields)
+        if st.button("מחק תחום") and rf: fields.remove(rf); update_settings_list("fields", fields); st.rerun()
+    with c2:
+        nt = st.text_input("תנאי חדש")
+        if st.button("הוסף תנאי") and nt: terms.append(nt); update_settings_list("payment_terms", terms); st.rerun()
+        rt = st.selectbox("מחק תנאי", [""]+terms)
+        if st.button("מחק תנאי") and rt: terms.remove(rt); update_settings_list("payment_terms", terms); st.rerun()
+    if STORAGE_BACKEND == "sheets":
+        with st.expander("📊 ניצול מכסות Google API"):
+            labels = {'sheets_read': "קריאות Sheets", 'sheets_write': "כתיבות Sheets", 'drive': "Drive"}
+            for kind, u in get_gateway().usage().items():
+                st.progress(min(1.0, u['last_minute'] / u['limit']),
+                            text=f"{labels[kind]}: {u['last_minute']}/{u['limit']} בדקה האחרונה · "
+                                 f"ניסיונות חוזרים {u['retries']} · שגיאות {u['errors']} · קריאות שאוחדו {u['coalesced']} · "
+                                 f"המתנה למכסה {u['throttled_seconds']:.1f} שנ'")
+
+def show_import_tab():
+    user_name = st.session_state.get('name', 'User')
+    st.download_button("📥 הורד תבנית", excel_template_bytes(), "template.xlsx")
+    up = st.file_uploader("העלה אקסל", type="xlsx")
+    job = st.session_state.get('import_job')
+    if up and job and job['file_key'] != (up.file_id, up.size): job = st.session_state['import_job'] = None
+    if job: st.info(f"יבוא קודם נעצר אחרי {job['done']} מתוך {len(job['rows'])} שורות. לחיצה על 'טען' תמשיך מאותה נקודה.")
+    if up and st.button("טען"):
+        try:
+            if not job:
+                valid_r, errs, warns = prepare_import(up, get_supplier_index(), user_name)
+                for w in warns[:50]: st.warning(w)
+                if len(warns) > 50: st.warning(f"ועוד {len(warns) - 50} שורות שדולגו")
+                if errs:
+                    for e in errs: st.error(e)
+                elif not valid_r: st.info("אין שורות חדשות לטעינה")
+                else: job = st.session_state['import_job'] = {'file_key': (up.file_id, up.size), 'rows': valid_r, 'done': 0}
+            if job:
+                prog = st.progress(job['done'] / len(job['rows']))
+                run_import_job(job, lambda done, total: prog.progress(done / total, text=f"{done}/{total}"))
+                st.session_state['import_job'] = None
+                st.success(f"נטענו {len(job['rows'])} ספקים!")
+                if job.get('skipped'): st.info(f"{job['skipped']} שורות כבר היו בגיליון אחרי הכשל הקודם ודולגו")
+        except Exception as e:
+            if job: st.error(f"הטעינה נעצרה אחרי {job['done']} מתוך {len(job['rows'])} שורות: {e}")
+            else: st.error(str(e))
+
+def show_delete_tab():
+    show_near_duplicate_scan()
+    show_admin_delete_table(get_worksheet_data("suppliers"), get_settings_lists()[0])
+
+TAB_RENDERERS = {
+    'suppliers': lambda: show_suppliers_table_readonly(get_worksheet_data("suppliers"), get_settings_lists()[0], is_admin=True),
+    'pending': lambda: show_pending_suppliers(get_worksheet_data("pending_suppliers")),
+    'users': show_user_management,
+    'add': lambda: show_supplier_form(pending=False),
+    'settings': show_settings_tab,
+    'import': show_import_tab,
+    'delete': show_delete_tab,
+    'search': lambda: show_suppliers_table_readonly(get_worksheet_data("suppliers"), get_settings_lists()[0]),
+    'suggest': lambda: show_supplier_form(pending=True),
+}
+
+@st.fragment
+def render_tab(tab):
+    """הטאב הפתוח. כ-fragment, אינטראקציה בתוכו מריצה מחדש רק אותו (והנתונים שלו נקראים מהמטמון)."""
+    with perf_trace(f"tab {tab}"):
+        TAB_RENDERERS[tab]()
+
 def main_app():
     user_role = st.session_state.get('role', 'user')
     user_name = st.session_state.get('name', 'User')
     current_email = st.session_state.get('username', '')
+    # הגיליונות של הכותרת ושל הטאב הפתוח נטענים יחד בבקשה אחת
+    tab = st.session_state.get(f"tab_{user_role}", "suppliers" if user_role == 'admin' else "search")
+    page_sheets = ["settings", "rejected_suppliers", "users", "active_users"] + TAB_SHEETS.get(tab, [])
+    if user_role == 'admin': page_sheets.append("pending_suppliers")
+    prefetch_worksheets(list(dict.fromkeys(page_sheets)))
     update_active_user(current_email)
-    
-    fields, terms = get_settings_lists()
-    df_supp = get_worksheet_data("suppliers")
+    show_write_failures()
 
     c1, c2, c3 = st.columns([6, 2, 1])
     c1.title(f"שלום, {user_name}")
-    if c2.button("🔄 רענן"): st.cache_data.clear(); st.rerun()
-    if c3.button("יציאה"): st.session_state['logged_in'] = False; st.rerun()
+    if c2.button("🔄 רענן"):
+        get_worksheet_cache().invalidate()
+        if STORAGE_BACKEND == "sheets": get_google_connection().reset()
+        st.rerun()
+    if c3.button("יציאה"): end_session(); st.rerun()
 
     with st.expander("📬 ההגשות שלי"):
         df_rej = get_worksheet_data("rejected_suppliers")
         my_rej = pd.DataFrame() 
         if not df_rej.empty:
-            mask = df_rej['נוסף על ידי'].astype(str).str.contains(user_name, na=False) | df_rej['נוסף על ידי'].astype(str).str.contains(current_email, na=False)
+            mask = column_contains(df_rej['נוסף על ידי'], user_name) | column_contains(df_rej['נוסף על ידי'], current_email)
             my_rej = df_rej[mask]
         if not my_rej.empty:
             st.error(f"יש {len(my_rej)} ספקים שנדחו.")
@@ -561,179 +2412,49 @@ def main_app():
 
     st.markdown("---")
 
+    # רק הטאב הפתוח נבנה, וכל טאב רץ כ-fragment: אינטראקציה בתוכו מריצה מחדש רק אותו
     if user_role == 'admin':
         df_pend_supp = get_worksheet_data("pending_suppliers")
-        cnt_s = len(df_pend_supp) if not df_pend_supp.empty else 0
-
-        # טאבים מעודכנים
-        tabs = st.tabs(["📋 רשימת ספקים", f"⏳ אישור ספקים ({cnt_s})", f"👥 ניהול משתמשים", "➕ הוספה", "⚙️ הגדרות", "📥 יבוא", "🗑️ מחיקת ספקים"])
-        
-        # טאב צפייה עם יכולת פתיחת כרטיס
-        with tabs[0]: 
-            show_suppliers_table_readonly(df_supp, fields, is_admin=True)
-        
-        with tabs[1]:
-            if cnt_s > 0:
-                for idx, row in df_pend_supp.iterrows():
-                    with st.expander(f"{row['שם הספק']}"):
-                        c1, c2 = st.columns(2)
-                        with c1:
-                            st.write(f"**תחום:** {row['תחום עיסוק']}")
-                            st.write(f"**טלפון:** {row['טלפון']}")
-                            st.write(f"**אימייל:** {row.get('אימייל', '')}")
-                        with c2:
-                            st.write(f"**כתובת:** {row['כתובת']}")
-                            st.write(f"**איש קשר:** {row.get('שם איש קשר', '')}")
-                            st.write(f"**תנאי תשלום:** {row['תנאי תשלום']}")
-                        
-                        st.divider()
-                        # תצוגת מסמכים לאישור
-                        show_file_links(row)
-                        st.divider()
-
-                        is_dup, msg = check_duplicate_supplier(df_supp, row['שם הספק'], row['טלפון'], row.get('אימייל',''))
-                        if is_dup: st.warning(msg)
-                        
-                        btn_c1, btn_c2 = st.columns(2)
-                        
-                        # הכנת שורה לאישור (כולל קבצים)
-                        row_to_add = [row['שם הספק'], row['תחום עיסוק'], row['טלפון'], row['כתובת'], row['תנאי תשלום'], row.get('אימייל',''), row.get('שם איש קשר',''), row['נוסף על ידי']]
-                        # הוספת עמודות קבצים (5 קישורים)
-                        extra_cols = ['link_agreement', 'link_bank', 'link_tax_books', 'link_tax_books', 'link_invoice']
-                        for ec in extra_cols:
-                            row_to_add.append(row.get(ec, ''))
-
-                        if btn_c1.button("אשר ספק ✅", key=f"s_ok_{idx}"):
-                            add_row_to_sheet("suppliers", row_to_add)
-                            delete_row_from_sheet("pending_suppliers", "שם הספק", row['שם הספק'])
-                            st.rerun()
-                        if btn_c2.button("דחה ספק ❌", key=f"s_no_{idx}"):
-                            rej = row.values.tolist(); rej.append(str(datetime.now()))
-                            add_row_to_sheet("rejected_suppliers", rej)
-                            delete_row_from_sheet("pending_suppliers", "שם הספק", row['שם הספק'])
-                            st.rerun()
-            else: st.info("אין ספקים ממתינים")
-
-        with tabs[2]: show_user_management()
-
-        with tabs[3]:
-            st.write("מילוי פרטי ספק חדש:")
-            with st.form("a_add"):
-                s_name = st.text_input("שם *")
-                s_f = st.multiselect("תחום *", fields)
-                s_p = st.text_input("טלפון *")
-                s_e = st.text_input("אימייל *")
-                s_c = st.text_input("איש קשר")
-                s_a = st.text_input("כתובת *")
-                s_pay = st.selectbox("תנאי *", terms)
-                
-                st.markdown("---")
-                st.write("📂 העלאת מסמכים (חובה):")
-                f1 = st.file_uploader("הסכם חתום *", type=['pdf','png','jpg','jpeg'])
-                f2 = st.file_uploader("אישור ניהול חשבון *", type=['pdf','png','jpg','jpeg'])
-                f3_combined = st.file_uploader("אישור ניכוי מס וניהול ספרים *", type=['pdf','png','jpg','jpeg'])
-                f5 = st.file_uploader("דוגמת חשבונית *", type=['pdf','png','jpg','jpeg'])
-                
-                if st.form_submit_button("שמור"):
-                    files_map = {'agreement': f1, 'bank': f2, 'tax_books': f3_combined, 'invoice': f5}
-                    valid, msg = validate_supplier_form(df_supp, s_name, s_f, s_p, s_e, s_a, s_pay, files_map)
-                    
-                    if valid:
-                        with st.spinner("מעלה קבצים..."):
-                            l_ag = upload_file_to_drive(f1, s_name + "_agree")
-                            l_bk = upload_file_to_drive(f2, s_name + "_bank")
-                            l_tb = upload_file_to_drive(f3_combined, s_name + "_taxbooks")
-                            l_in = upload_file_to_drive(f5, s_name + "_inv")
-                            
-                            links_part = [l_ag, l_bk, l_tb, l_tb, l_in]
-                            
-                            row_data = [s_name, ", ".join(s_f), s_p, s_a, s_pay, s_e, s_c, user_name] + links_part
-                            add_row_to_sheet("suppliers", row_data)
-                            st.success("נוסף בהצלחה!")
-                            time.sleep(1); st.rerun()
-                    else: st.error(msg)
-
-        with tabs[4]:
-            c1, c2 = st.columns(2)
-            with c1:
-                nf = st.text_input("תחום חדש")
-                if st.button("הוסף תחום") and nf: fields.append(nf); update_settings_list("fields", fields); st.rerun()
-                rf = st.selectbox("מחק תחום", [""]+fields)
-                if st.button("מחק תחום") and rf: fields.remove(rf); update_settings_list("fields", fields); st.rerun()
-            with c2:
-                nt = st.text_input("תנאי חדש")
-                if st.button("הוסף תנאי") and nt: terms.append(nt); update_settings_list("payment_terms", terms); st.rerun()
-                rt = st.selectbox("מחק תנאי", [""]+terms)
-                if st.button("מחק תנאי") and rt: terms.remove(rt); update_settings_list("payment_terms", terms); st.rerun()
-
-        with tabs[5]:
-            buf = generate_excel_template()
-            st.download_button("📥 הורד תבנית", buf, "template.xlsx")
-            up = st.file_uploader("העלה אקסל", type="xlsx")
-            if up and st.button("טען"):
-                try:
-                    ndf = pd.read_excel(up).astype(str).replace('nan', '')
-                    req = ['שם הספק', 'תחום עיסוק', 'טלפון', 'אימייל', 'כתובת', 'שם איש קשר', 'תנאי תשלום']
-                    if not all(c in ndf.columns for c in req): st.error("כותרות שגויות")
-                    else:
-                        valid_r = []; errs = []
-                        for idx, row in ndf.iterrows():
-                            if not row['שם הספק'].strip(): errs.append(f"שורה {idx+2}: חסר שם"); continue
-                            valid_r.append([row[c].strip() for c in req] + [user_name])
-                        if errs: 
-                            for e in errs: st.error(e)
-                        else:
-                            cl = get_client(); sh = cl.open(SHEET_NAME).worksheet("suppliers")
-                            sh.append_rows(valid_r); st.success("נטען!"); st.cache_data.clear()
-                except Exception as e: st.error(str(e))
-
-        with tabs[6]: show_admin_delete_table(df_supp, fields)
-
-    else:
-        utabs = st.tabs(["🔎 חיפוש", "➕ הצעה"])
-        with utabs[0]: show_suppliers_table_readonly(df_supp, fields)
-        with utabs[1]:
-            with st.form("u_a"):
-                s_name = st.text_input("שם *")
-                s_f = st.multiselect("תחום *", fields)
-                s_p = st.text_input("טלפון *")
-                s_e = st.text_input("אימייל *")
-                s_c = st.text_input("איש קשר")
-                s_a = st.text_input("כתובת *")
-                s_pay = st.selectbox("תנאי *", terms)
-                
-                st.markdown("---")
-                st.write("📂 העלאת מסמכים (חובה):")
-                f1 = st.file_uploader("הסכם חתום *", type=['pdf','png','jpg','jpeg'])
-                f2 = st.file_uploader("אישור ניהול חשבון *", type=['pdf','png','jpg','jpeg'])
-                f3_combined = st.file_uploader("אישור ניכוי מס וניהול ספרים *", type=['pdf','png','jpg','jpeg'])
-                f5 = st.file_uploader("דוגמת חשבונית *", type=['pdf','png','jpg','jpeg'])
-
-                if st.form_submit_button("שלח"):
-                    files_map = {'agreement': f1, 'bank': f2, 'tax_books': f3_combined, 'invoice': f5}
-                    valid, msg = validate_supplier_form(df_supp, s_name, s_f, s_p, s_e, s_a, s_pay, files_map)
-                    if valid:
-                        with st.spinner("מעלה קבצים ושולח לאישור..."):
-                            l_ag = upload_file_to_drive(f1, s_name + "_agree")
-                            l_bk = upload_file_to_drive(f2, s_name + "_bank")
-                            l_tb = upload_file_to_drive(f3_combined, s_name + "_taxbooks")
-                            l_in = upload_file_to_drive(f5, s_name + "_inv")
-                            
-                            links = [l_ag, l_bk, l_tb, l_tb, l_in]
-                            
-                            row_data = [s_name, ", ".join(s_f), s_p, s_a, s_pay, s_e, s_c, user_name] + links + [str(datetime.now())]
-                            
-                            add_row_to_sheet("pending_suppliers", row_data)
-                            st.success("נשלח לאישור!")
-                    else: st.error(msg)
+        labels = dict(ADMIN_TABS, pending=f"{ADMIN_TABS['pending']} ({len(df_pend_supp)})")
+    else: labels = USER_TABS
+    tab = st.radio("טאב", list(labels), format_func=labels.get, horizontal=True, label_visibility="collapsed", key=f"tab_{user_role}")
+    render_tab(tab)
 
     cnt, names = get_online_users_count_and_names()
     names_html = "<br>".join(names) if names else "אין"
     tooltip = f'<div class="online-list"><strong>מחוברים:</strong><br>{names_html}</div>'
     st.markdown(f'<div class="online-container">{tooltip}<div class="online-badge">🟢 מחוברים: {cnt}</div></div>', unsafe_allow_html=True)
+    if user_role == 'admin': show_perf_panel()
+
+def show_perf_panel():
+    """פאנל מנהל: האירועים של הריצה הנוכחית וסיכום הריצות האחרונות."""
+    with st.expander("⏱️ ביצועים"):
+        trace, elapsed = current_trace()
+        summary = summarize_trace(trace, elapsed)
+        c1, c2, c3, c4, c5 = st.columns(5)
+        c5.metric("זמן ריצה עד כה (ms)", summary['total_ms'])
+        startup = get_startup_stats()
+        st.caption(f"הפעלה קרה: יבוא {startup.imports_ms} ms · ריצה ראשונה {startup.first_run_ms} ms · "
+                   f"כניסה ראשונה {startup.first_login_ms} ms")
+        c1.metric("קריאות API", summary['api_calls'])
+        c2.metric("זמן API (ms)", summary['api_ms'])
+        c3.metric("פגיעות מטמון", summary['cache_hits'])
+        c4.metric("החטאות מטמון", summary['cache_misses'])
+        if trace:
+            st.dataframe(pd.DataFrame(trace)[['kind', 'name', 'ms', 'thread']].sort_values('ms', ascending=False),
+                         hide_index=True, use_container_width=True)
+        history = st.session_state.get('perf_history', [])
+        if history:
+            st.caption("ריצות קודמות")
+            st.dataframe(pd.DataFrame(history[::-1]), hide_index=True, use_container_width=True)
 
 # --- 10. הרצה ---
-set_css()
-if 'logged_in' not in st.session_state: st.session_state['logged_in'] = False
-if not st.session_state['logged_in']: login_page()
-else: main_app()
+# streamlit מריץ את הקובץ כ-__main__; ביבוא (למשל מ-bench.py) רק הפונקציות נטענות
+if __name__ == "__main__":
+    with perf_trace("app"):
+        set_css()
+        if 'logged_in' not in st.session_state: st.session_state['logged_in'] = False
+        if not st.session_state['logged_in'] and not restore_session(): login_page()
+        else: main_app()
+        flush_session_cookie()
+    get_startup_stats().record(st.session_state['perf_history'][-1], st.session_state.pop('login_run', False))
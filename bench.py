@@ -0,0 +1,248 @@
+"""
+מדידת ביצועים על נתונים סינתטיים לנתיבים החמים של app.py.
+
+    python bench.py                       # 1,000 / 10,000 / 100,000 ספקים
+    python bench.py --sizes 1000 5000 --repeat 3
+    python bench.py --no-save             # רק הדפסה
+
+גודל 0 הוא זמן ההפעלה הקרה (יבוא app.py בתהליך חדש).
+כל ריצה נשמרת כשורת JSON ב-bench_results.jsonl (או --out) ומושווית לריצה הקודמת
+באותו גודל. מדידה שהאטה ביותר מ---threshold (ברירת מחדל 25%) מסומנת, ויציאה בקוד 1.
+"""
+import argparse
+import io
+import json
+import logging
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+# אחסון מקומי וזמני לפני יבוא האפליקציה, כדי שלא תיגע ב-Google ולא בקובץ המקומי האמיתי
+_TMP = tempfile.mkdtemp(prefix="bench_")
+os.environ["STORAGE_BACKEND"] = "sqlite"
+os.environ["SQLITE_PATH"] = os.path.join(_TMP, "bench.db")
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import pandas as pd
+from openpyxl import Workbook
+import app
+
+# מחוץ ל-streamlit run כל גישה למטמונים מזהירה על "bare mode"
+for _name in list(logging.root.manager.loggerDict):
+    if _name.startswith("streamlit"): logging.getLogger(_name).setLevel(logging.ERROR)
+
+# --- נתונים סינתטיים ---
+FIRST = ["אבי", "משה", "דנה", "יעל", "רונית", "יוסי", "שרה", "מיכאל", "נועה", "עמית", "תמר", "אורי"]
+LAST = ["כהן", "לוי", "מזרחי", "פרץ", "ביטון", "אברהם", "פרידמן", "שפירא", "גולן", "אזולאי"]
+WORDS = ["שירותי", "הנדסה", "בנייה", "חשמל", "אינסטלציה", "ייעוץ", "מחשוב", "הובלות", "ניקיון", "שיווק",
+         "דפוס", "אבטחה", "גינון", "מזון", "ציוד", "משרדי", "תעשיות", "פתרונות", "מערכות", "אחזקה"]
+SUFFIX = ['בע"מ', "ושות'", "ובניו", "יזמות", ""]
+CITIES = ["תל אביב", "ירושלים", "חיפה", "באר שבע", "נתניה", "אשדוד", "רחובות", "פתח תקווה"]
+STREETS = ["הרצל", "ויצמן", "בן גוריון", "ז'בוטינסקי", "רוטשילד", "העצמאות", "הנביאים"]
+CATEGORIES = ["בנייה", "חשמל", "אינסטלציה", "מחשוב", "ייעוץ", "הובלות", "ניקיון", "שיווק", "דפוס", "אבטחה"]
+PAYMENTS = ["שוטף + 30", "שוטף + 60", "מזומן", "העברה בנקאית"]
+QUERIES = ["כהן", "חשמל", "תל אביב", "054", "שירותי הנדסה", "בע״מ", "xyz-לא-קיים"]
+
+def make_suppliers(n, rng):
+    rows = []
+    for i in range(n):
+        name = f"{rng.choice(WORDS)} {rng.choice(WORDS)} {rng.choice(LAST)} {rng.choice(SUFFIX)} {i}".replace("  ", " ")
+        rows.append([name, ", ".join(rng.sample(CATEGORIES, rng.randint(1, 3))), f"05{rng.randint(0, 9)}-{i:07d}",
+                     f"{rng.choice(STREETS)} {rng.randint(1, 200)}, {rng.choice(CITIES)}", rng.choice(PAYMENTS),
+                     f"supplier{i}@example.co.il", f"{rng.choice(FIRST)} {rng.choice(LAST)}", f"user{rng.randrange(50)}@example.com",
+                     "", "", "", "", ""])
+    return pd.DataFrame(rows, columns=app.SUPPLIER_COLUMNS)
+
+def make_users(n, rng):
+    return pd.DataFrame([[f"user{i}@example.com", "x", "user", f"{rng.choice(FIRST)} {rng.choice(LAST)}"] for i in range(n)],
+                        columns=app.WORKSHEET_HEADERS["users"])
+
+def make_import_file(df, rng, dup_ratio=0.05):
+    """קובץ אקסל בתבנית היבוא: ספקים חדשים, כמה כפולים מול הקיימים וכמה שורות בלי שם."""
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet("Sheet1")
+    ws.append(app.IMPORT_COLUMNS)
+    existing = df['שם הספק'].tolist()
+    for i in range(len(df)):
+        r = rng.random()
+        name = rng.choice(existing) if r < dup_ratio else ("" if r < dup_ratio * 1.2 else f"ספק חדש {i}")
+        ws.append([name, rng.choice(CATEGORIES), f"03-{i:07d}", f"new{i}@example.org",
+                   rng.choice(CITIES), f"{rng.choice(FIRST)} {rng.choice(LAST)}", rng.choice(PAYMENTS)])
+    buf = io.BytesIO()
+    wb.save(buf)
+    return buf.getvalue()
+
+def seed_storage(suppliers, users, rng):
+    """ממלא את האחסון הזמני כך ש-get_online_users_count_and_names תעבוד על נתונים בגודל הנבדק."""
+    storage = app.get_storage()
+    now = datetime.now()
+    active = [[u, (now - timedelta(seconds=rng.randint(0, 2 * app.ONLINE_WINDOW))).strftime(app.TS_FORMAT)]
+              for u in users['username'].tolist()]
+    storage.replace_values("suppliers", [app.SUPPLIER_COLUMNS] + suppliers.values.tolist())
+    storage.replace_values("users", [list(users.columns)] + users.values.tolist())
+    storage.replace_values("active_users", [app.WORKSHEET_HEADERS["active_users"]] + active)
+    for ws in ("suppliers", "users", "active_users"): app.get_worksheet_cache().invalidate(ws)
+    registry = app.get_presence_registry()
+    for u in users['username'].sample(min(len(users), 20), random_state=1): registry.heartbeat(u)
+
+# --- מדידה ---
+def timeit(fn, repeat, number=1):
+    """(מינימום, חציון) במילישניות לקריאה אחת, מתוך repeat סבבים של number קריאות."""
+    fn()  # חימום
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        for _ in range(number): fn()
+        times.append((time.perf_counter() - t0) * 1000 / number)
+    return round(min(times), 4), round(statistics.median(times), 4)
+
+def run_size(n, repeat, seed):
+    rng = random.Random(seed)
+    df = make_suppliers(n, rng)
+    users = make_users(max(10, n // 10), rng)
+    index = app.SupplierIndex(df)
+    search_index = app.SupplierSearchIndex(df)
+    near_index = app.NearDuplicateIndex(df)
+    probes = [(r['שם הספק'], r['טלפון'], r['אימייל']) for r in df.sample(50, random_state=seed, replace=n < 50).to_dict('records')]
+    probes += [(f"ספק לא קיים {i}", f"02-{i:07d}", f"none{i}@x.com") for i in range(50)]
+    files = {k: object() for k in ["link_agreement", "link_bank", "link_tax_books", "link_books", "link_invoice"]}
+    import_bytes = make_import_file(df, rng)
+    seed_storage(df, users, rng)
+    snapshot = app.compact_frame("suppliers", df)
+    cat_index = app.CategoryIndex(snapshot)
+    memory = {"suppliers_raw_bytes": int(df.memory_usage(deep=True).sum()),
+              "suppliers_snapshot_bytes": int(snapshot.memory_usage(deep=True).sum())}
+    print(f"  זיכרון: {memory['suppliers_raw_bytes'] / 1e6:.1f}MB -> {memory['suppliers_snapshot_bytes'] / 1e6:.1f}MB", flush=True)
+
+    def check_indexed():
+        for name, phone, email in probes: app.check_duplicate_supplier(df, name, phone, email, index=index)
+
+    def validate_indexed():
+        for name, phone, email in probes:
+            app.validate_supplier_form(df, name, "בנייה", phone, email, "הרצל 1", "מזומן", files, index=index)
+
+    def near_find():
+        for name, phone, email in probes: near_index.find(name, phone, email)
+
+    def search_all():
+        for q in QUERIES: df.iloc[search_index.search(q)]
+
+    def template_roundtrip():
+        blocks = app.iter_excel_blocks(io.BytesIO(app.generate_excel_template().getvalue()))
+        assert next(blocks) == app.IMPORT_COLUMNS
+        list(blocks)
+
+    def online_users():
+        app.get_worksheet_cache().invalidate("active_users")
+        app.get_worksheet_cache().invalidate("users")
+        return app.get_online_users_count_and_names()
+
+    n_probes, n_queries = len(probes), len(QUERIES)
+    heavy = max(1, repeat // 3)
+    cases = {
+        "dup_index_build": (lambda: app.SupplierIndex(df), repeat, 1),
+        "check_duplicate_unindexed": (lambda: app.check_duplicate_supplier(df, *probes[-1]), heavy, 1),
+        f"check_duplicate_indexed_x{n_probes}": (check_indexed, repeat, 1),
+        "dup_flag_frame_1000": (lambda: index.flag_frame(df.iloc[:1000]), repeat, 1),
+        f"validate_supplier_form_x{n_probes}": (validate_indexed, repeat, 1),
+        "near_dup_index_build": (lambda: app.NearDuplicateIndex(df), heavy, 1),
+        f"near_dup_find_x{n_probes}": (near_find, repeat, 1),
+        "near_dup_scan_1000": (lambda: near_index.scan(df.iloc[:1000]), heavy, 1),
+        "search_index_build": (lambda: app.SupplierSearchIndex(df), heavy, 1),
+        f"search_x{n_queries}": (search_all, repeat, 1),
+        "compact_frame": (lambda: app.compact_frame("suppliers", df), heavy, 1),
+        "category_filter": (lambda: df[app.column_contains(snapshot['תחום עיסוק'], "חשמל")], repeat, 1),
+        "category_index_build": (lambda: app.CategoryIndex(snapshot), repeat, 1),
+        "category_filter_or_and": (lambda: [cat_index.mask(["חשמל", "בנייה"], m) for m in (False, True)], repeat, 5),
+        "category_counts": (lambda: cat_index.counts(search_index.search("כהן")), repeat, 5),
+        "render_page_html": (lambda: app.render_suppliers_html(df.iloc[:app.SUPPLIERS_PAGE_SIZE]), repeat, 5),
+        "render_all_html": (lambda: app.render_suppliers_html(df), heavy, 1),
+        "excel_template_roundtrip": (template_roundtrip, repeat, 1),
+        "prepare_import": (lambda: app.prepare_import(io.BytesIO(import_bytes), index, "bench"), heavy, 1),
+        "export_csv": (lambda: app.export_suppliers_csv(snapshot), heavy, 1),
+        "export_xlsx": (lambda: app.export_suppliers_xlsx(snapshot), heavy, 1),
+        "online_users": (online_users, repeat, 1),
+        "online_users_cached": (app.get_online_users_count_and_names, repeat, 5),
+    }
+    results = {}
+    for name, (fn, r, number) in cases.items():
+        best, median = timeit(fn, r, number)
+        results[name] = {"min_ms": best, "median_ms": median}
+        print(f"  {name:<34} min {best:>10.3f} ms   median {median:>10.3f} ms", flush=True)
+    return results, memory
+
+STARTUP_SNIPPET = """
+import time; t0 = time.perf_counter()
+import app
+print((time.perf_counter() - t0) * 1000, app._IMPORTS_MS)
+"""
+
+def run_startup(repeat):
+    """הפעלה קרה: יבוא app.py בתהליך חדש (כולל streamlit ו-pandas). נשמר כגודל 0."""
+    totals, imports = [], []
+    for _ in range(repeat):
+        out = subprocess.run([sys.executable, "-c", STARTUP_SNIPPET], capture_output=True, text=True, check=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), env=os.environ).stdout.split()
+        totals.append(float(out[0])); imports.append(float(out[1]))
+    results = {"cold_import_app": {"min_ms": round(min(totals), 4), "median_ms": round(statistics.median(totals), 4)},
+               "cold_import_modules": {"min_ms": round(min(imports), 4), "median_ms": round(statistics.median(imports), 4)}}
+    for name, r in results.items():
+        print(f"  {name:<34} min {r['min_ms']:>10.3f} ms   median {r['median_ms']:>10.3f} ms", flush=True)
+    return results, {}
+
+# --- שמירה והשוואה ---
+def load_previous(path, size):
+    if not os.path.exists(path): return None
+    last = None
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            try: rec = json.loads(line)
+            except ValueError: continue
+            if rec.get("size") == size: last = rec
+    return last
+
+def compare(previous, results, threshold):
+    """רשימת (מדידה, זמן קודם, זמן נוכחי) שהאטו מעבר לסף. ההשוואה לפי המינימום, הפחות רועש."""
+    if not previous: return []
+    slower = []
+    for name, cur in results.items():
+        old = previous["results"].get(name)
+        if old and old["min_ms"] > 0.05 and cur["min_ms"] > old["min_ms"] * (1 + threshold):
+            slower.append((name, old["min_ms"], cur["min_ms"]))
+    return slower
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--out", default="bench_results.jsonl")
+    parser.add_argument("--threshold", type=float, default=0.25)
+    parser.add_argument("--no-save", action="store_true")
+    args = parser.parse_args()
+
+    regressions = []
+    for n in [0] + args.sizes:
+        print("== הפעלה קרה ==" if n == 0 else f"== {n:,} ספקים ==", flush=True)
+        results, memory = run_startup(args.repeat) if n == 0 else run_size(n, args.repeat, args.seed)
+        for name, old, cur in compare(load_previous(args.out, n), results, args.threshold):
+            regressions.append((n, name, old, cur))
+            print(f"  ! {name}: {old:.3f} -> {cur:.3f} ms (+{(cur / old - 1) * 100:.0f}%)")
+        if not args.no_save:
+            rec = {"ts": datetime.now().strftime(app.TS_FORMAT), "size": n, "repeat": args.repeat, "seed": args.seed,
+                   "python": platform.python_version(), "pandas": pd.__version__, "machine": platform.node(),
+                   "results": results, "memory": memory}
+            with open(args.out, "a", encoding="utf-8") as f: f.write(json.dumps(rec, ensure_ascii=False) + "\n")
+    if regressions:
+        print(f"{len(regressions)} מדידות האטו ביותר מ-{args.threshold:.0%} לעומת הריצה הקודמת.")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
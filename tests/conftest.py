@@ -0,0 +1,41 @@
+"""
+הבדיקות רצות מול מאגר SQLite זמני (STORAGE_BACKEND=sqlite), בלי גישה ל-Google.
+
+    python -m pytest -q
+"""
+import logging
+import os
+import sys
+import tempfile
+
+import pytest
+
+# אחסון מקומי וזמני לפני יבוא האפליקציה
+_TMP = tempfile.mkdtemp(prefix="tests_")
+os.environ["STORAGE_BACKEND"] = "sqlite"
+os.environ["SQLITE_PATH"] = os.path.join(_TMP, "store.db")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app
+
+# מחוץ ל-streamlit run כל גישה למטמונים מזהירה על "bare mode"
+for _name in list(logging.root.manager.loggerDict):
+    if _name.startswith("streamlit"): logging.getLogger(_name).setLevel(logging.ERROR)
+
+@pytest.fixture
+def storage():
+    """המאגר המשותף, ריק, עם מטמון נקי."""
+    app.get_write_queue().wait_for()
+    storage = app.get_storage()
+    for ws, headers in app.WORKSHEET_HEADERS.items(): storage.replace_values(ws, [headers])
+    app.get_worksheet_cache().invalidate()
+    return storage
+
+@pytest.fixture
+def supplier_row():
+    """שורת ספק בסדר עמודות הגיליון."""
+    def make(name, category="", phone="", email=""):
+        row = dict.fromkeys(app.SUPPLIER_COLUMNS, "")
+        row.update({'שם הספק': name, 'תחום עיסוק': category, 'טלפון': phone, 'אימייל': email})
+        return list(row.values())
+    return make
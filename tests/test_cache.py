@@ -0,0 +1,103 @@
+from datetime import datetime
+
+import pytest
+
+import app
+
+@pytest.fixture
+def cache(storage, monkeypatch):
+    cache = app.get_worksheet_cache()
+    monkeypatch.setattr(cache, "ttl", 0)
+    return cache
+
+@pytest.fixture
+def count_full_loads(storage, monkeypatch):
+    loads = []
+    get_records = storage.get_records
+    monkeypatch.setattr(storage, "get_records", lambda ws: loads.append(ws) or get_records(ws))
+    return loads
+
+def test_unchanged_token_keeps_snapshot(storage, cache, count_full_loads):
+    storage.append_rows("users", [["a@x.com", "h", "user", "A"]])
+    app.get_worksheet_data("users")
+    version = cache.version("users")
+    app.get_worksheet_data("users")
+    assert count_full_loads == ["users"] and cache.version("users") == version
+
+def test_in_place_edit_is_visible_after_ttl(storage, cache):
+    storage.append_rows("users", [["a@x.com", "h", "user", "A"], ["b@x.com", "h", "user", "B"]])
+    assert app.get_user_record("a@x.com")['role'] == "user"
+    storage.update_cells("users", 2, {3: "admin"})
+    assert app.get_user_record("a@x.com")['role'] == "admin"
+
+def test_appended_and_deleted_rows_are_visible_after_ttl(storage, cache):
+    storage.append_rows("users", [["a@x.com", "h", "user", "A"]])
+    app.get_worksheet_data("users")
+    storage.append_rows("users", [["b@x.com", "h", "user", "B"]])
+    storage.delete_rows("users", [2])
+    assert app.get_worksheet_data("users")['username'].tolist() == ["b@x.com"]
+
+def test_patches_update_snapshot_and_version(storage):
+    storage.append_rows("users", [["a@x.com", "h", "user", "A"]])
+    cache = app.get_worksheet_cache()
+    before = app.get_worksheet_data("users")
+    version = cache.version("users")
+    app.cache_append_rows("users", [["b@x.com", "h", "user", "B"]])
+    app.cache_update_row("users", 'username', "A@X.COM", {3: "admin"}, case_insensitive=True)
+    after = app.get_worksheet_data("users")
+    assert after['role'].tolist() == ["admin", "user"] and cache.version("users") == version + 2
+    # תמונת המצב הקודמת לא השתנתה
+    assert before['role'].tolist() == ["user"]
+    app.cache_drop_rows("users", 'username', ["b@x.com"])
+    assert app.get_worksheet_data("users")['username'].tolist() == ["a@x.com"]
+
+def test_load_racing_a_write_is_not_stored(storage):
+    storage.append_rows("users", [["a@x.com", "h", "user", "A"]])
+    cache = app.WorksheetCache()
+    def loader(ws, *args):
+        cache.patch(ws, lambda df: df)
+        return app._load_worksheet(ws, *args)
+    assert len(cache.get("users", loader)) == 1
+    assert cache._entries == {}
+
+def test_derived_structures_follow_the_version(storage):
+    storage.append_rows("users", [["a@x.com", "h", "user", "A"]])
+    assert app.get_usernames("users") == {"a@x.com"}
+    app.cache_append_rows("users", [["b@x.com", "h", "user", "B"]])
+    assert app.get_usernames("users") == {"a@x.com", "b@x.com"}
+
+def test_derived_for_only_reuses_the_current_snapshot(storage):
+    cache = app.get_worksheet_cache()
+    storage.append_rows("users", [["a@x.com", "h", "user", "A"]])
+    df = app.get_worksheet_data("users")
+    built = []
+    build = lambda frame: built.append(len(frame)) or len(frame)
+    assert cache.derived_for("users", 'n', build, df) == 1
+    assert cache.derived_for("users", 'n', build, df) == 1
+    assert cache.derived_for("users", 'n', build, df.copy()) == 1
+    assert built == [1, 1]
+
+def test_own_writes_do_not_reload_other_sheets(storage, cache, count_full_loads, supplier_row):
+    storage.append_rows("suppliers", [supplier_row("אלון")])
+    app.get_worksheet_data("suppliers")
+    app._flush_presence({"a@x.com": datetime.now()})
+    app.add_row_to_sheet("users", ["a@x.com", "h", "user", "A"])
+    assert app.get_worksheet_data("suppliers")['שם הספק'].tolist() == ["אלון"]
+    assert count_full_loads == ["suppliers", "active_users"]
+    # שינוי חיצוני עדיין נטען
+    storage.append_rows("suppliers", [supplier_row("דני")])
+    assert app.get_worksheet_data("suppliers")['שם הספק'].tolist() == ["אלון", "דני"]
+
+def test_prefetch_batches_cold_and_changed_sheets(storage, cache, monkeypatch):
+    batches = []
+    get_many_records = storage.get_many_records
+    monkeypatch.setattr(storage, "get_many_records", lambda names: batches.append(list(names)) or get_many_records(names))
+    storage.append_rows("users", [["a@x.com", "h", "user", "A"]])
+    app.prefetch_worksheets(["users", "settings"])
+    app.prefetch_worksheets(["users", "settings"])
+    storage.append_rows("users", [["b@x.com", "h", "user", "B"]])
+    app.prefetch_worksheets(["users", "settings", "active_users"])
+    assert batches == [["users", "settings"], ["users", "settings", "active_users"]]
+    version = cache.version("users")
+    assert app.get_worksheet_data("users")['username'].tolist() == ["a@x.com", "b@x.com"]
+    assert cache.version("users") == version
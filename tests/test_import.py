@@ -0,0 +1,66 @@
+import io
+
+import pandas as pd
+import pytest
+from openpyxl import Workbook
+
+import app
+
+def workbook(rows, header=app.IMPORT_COLUMNS):
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet()
+    ws.append(header)
+    for r in rows: ws.append(r)
+    buffer = io.BytesIO()
+    wb.save(buffer)
+    buffer.seek(0)
+    return buffer
+
+def import_row(name, phone="", email=""):
+    return [name, "חשמל", phone, email, "תל אביב", "", "שוטף + 30"]
+
+def test_prepare_import_validates_and_dedupes(monkeypatch, supplier_row):
+    monkeypatch.setattr(app, "IMPORT_READ_BLOCK", 2)
+    existing = pd.DataFrame([supplier_row("קיים", phone="050-1111111")], columns=app.SUPPLIER_COLUMNS)
+    rows = [import_row("חדש", 521234567, "a@x.com"), import_row(""), import_row("אחר", "0501111111"),
+            [None] * 7, import_row("עוד אחד", "052-1234567"), import_row(" חדש ")]
+    valid, errors, warnings = app.prepare_import(workbook(rows), app.SupplierIndex(existing), "admin@x.com")
+    assert valid == [["חדש", "חשמל", "521234567", "תל אביב", "שוטף + 30", "a@x.com", "", "admin@x.com"]]
+    assert errors == ["שורה 3: חסר שם"]
+    assert warnings == ["שורה 4: ספק כבר קיים במערכת - דולג", "שורה 6: כפול בתוך הקובץ - דולג",
+                        "שורה 7: כפול בתוך הקובץ - דולג"]
+
+def test_prepare_import_reports_missing_headers():
+    valid, errors, _ = app.prepare_import(workbook([], header=["שם הספק"]), app.SupplierIndex(pd.DataFrame()), "a")
+    assert valid == [] and errors[0].startswith("כותרות חסרות")
+
+def test_import_job_resumes_after_a_failed_chunk(storage, monkeypatch):
+    monkeypatch.setattr(app, "IMPORT_CHUNK_SIZE", 2)
+    append_rows, calls = storage.append_rows, []
+    def flaky(ws, rows):
+        calls.append(len(rows))
+        if len(calls) == 2: raise RuntimeError("quota")
+        append_rows(ws, rows)
+    monkeypatch.setattr(storage, "append_rows", flaky)
+    job = {'rows': [[f"ספק {i}"] for i in range(5)], 'done': 0}
+    with pytest.raises(RuntimeError): app.run_import_job(job)
+    assert job['done'] == 2
+    progress = []
+    app.run_import_job(job, on_progress=lambda done, total: progress.append((done, total)))
+    assert progress == [(4, 5), (5, 5)]
+    assert [r['שם הספק'] for r in storage.get_records("suppliers")] == [f"ספק {i}" for i in range(5)]
+
+def test_import_job_rechecks_rows_after_an_ambiguous_failure(storage, monkeypatch, supplier_row):
+    monkeypatch.setattr(app, "IMPORT_CHUNK_SIZE", 2)
+    append_rows, calls = storage.append_rows, []
+    def saved_then_timed_out(ws, rows):
+        calls.append(len(rows))
+        append_rows(ws, rows)
+        if len(calls) == 2: raise TimeoutError("read timed out")
+    monkeypatch.setattr(storage, "append_rows", saved_then_timed_out)
+    job = {'rows': [supplier_row(f"ספק {i}")[:8] for i in range(5)], 'done': 0}
+    with pytest.raises(TimeoutError): app.run_import_job(job)
+    assert job['done'] == 2 and job['verify']
+    app.run_import_job(job)
+    assert job['skipped'] == 2 and calls == [2, 2, 1]
+    assert [r['שם הספק'] for r in storage.get_records("suppliers")] == [f"ספק {i}" for i in range(5)]
@@ -0,0 +1,70 @@
+import pandas as pd
+import pytest
+
+import app
+
+@pytest.fixture
+def suppliers(supplier_row):
+    rows = [supplier_row('חברת שָׁלוֹם בע"מ', "בנייה, חשמל", "052-1234567", "a@b.com"),
+            supplier_row("אלון מזגנים", "חשמל", "03-5551234", "Alon@x.com"),
+            supplier_row("דני הובלות", "הובלות", "", ""),
+            supplier_row("סניף 1", "חשמל רכב", "", "")]
+    return pd.DataFrame(rows, columns=app.SUPPLIER_COLUMNS)
+
+@pytest.mark.parametrize("query, rows", [("שלום", [0]), ("שלומ", [0]), ("בעמ", [0]), ("0521234567", [0]),
+                                         ("052-123", [0]), ("alon@", [1]), ("מזגנים אלון", [1]), ("ני", [1, 2, 3]),
+                                         ("xyz", []), ("", [0, 1, 2, 3])])
+def test_search_index(suppliers, query, rows):
+    assert app.SupplierSearchIndex(suppliers).search(query).tolist() == rows
+
+def test_category_index_or_and_counts(suppliers):
+    index = app.CategoryIndex(suppliers)
+    assert index.mask(["חשמל"]).tolist() == [True, True, False, False]
+    assert index.mask(["בנייה", "הובלות"]).tolist() == [True, False, True, False]
+    assert index.mask(["בנייה", "חשמל"], match_all=True).tolist() == [True, False, False, False]
+    assert not index.mask(["חשמל", "אין כזה"], match_all=True).any()
+    assert index.counts() == {'בנייה': 1, 'הובלות': 1, 'חשמל': 2, 'חשמל רכב': 1}
+    assert index.counts([1, 2]) == {'בנייה': 0, 'הובלות': 1, 'חשמל': 1, 'חשמל רכב': 0}
+
+def test_supplier_index_finds_duplicates(suppliers):
+    index = app.SupplierIndex(suppliers)
+    assert index.find_duplicate(" אלון מזגנים ", "", "")[0]
+    assert index.find_duplicate("חדש", "+972-52-1234567", "")[0]
+    assert not index.find_duplicate("חדש", "", "new@x.com")[0]
+
+def test_supplier_index_flags_frame(suppliers, supplier_row):
+    index = app.SupplierIndex(suppliers)
+    new = pd.DataFrame([supplier_row("חדש", email="ALON@x.com"), supplier_row("כפול"), supplier_row("כפול"),
+                        supplier_row("ייחודי")], columns=app.SUPPLIER_COLUMNS)
+    assert index.flag_frame(new).tolist() == ["אימייל קיים", "כפול בתוך הרשימה", "כפול בתוך הרשימה", ""]
+
+def test_near_duplicate_index(suppliers):
+    index = app.NearDuplicateIndex(suppliers)
+    assert [m[0] for m in index.find("חברת שלום בעמ", "", "")] == [0]
+    assert [m[0] for m in index.find("אחר", "0521234567", "")] == [0]
+    # שמות שנבדלים רק במספר הם ספקים שונים
+    assert index.find("סניף 2", "", "") == []
+    assert index.scan().empty
+    pending = pd.DataFrame({'שם הספק': ["דני  הובלות בע\"מ", "חדש לגמרי"]})
+    assert index.scan(pending)[['row', 'match_row']].values.tolist() == [[0, 2]]
+
+def test_search_follows_in_place_edits(storage, supplier_row):
+    storage.append_rows("suppliers", [supplier_row("אלון", "חשמל"), supplier_row("דני", "בנייה")])
+    df = app.get_worksheet_data("suppliers")
+    assert app.search_positions(df, "אלון").tolist() == [0]
+    app.cache_update_row("suppliers", 'שם הספק', "דני", {1: "דני החדש"})
+    df = app.get_worksheet_data("suppliers")
+    assert app.search_positions(df, "החדש").tolist() == [1]
+    # df שאינו תמונת המצב (למשל חלק ממנה) מקבל אינדקס משלו
+    assert app.search_positions(df.iloc[1:], "החדש").tolist() == [0]
+
+def test_category_filter_follows_in_place_edits(storage, supplier_row):
+    storage.append_rows("suppliers", [supplier_row("אלון", "חשמל"), supplier_row("דני", "בנייה")])
+    df = app.get_worksheet_data("suppliers")
+    assert app.filter_suppliers(df, "", ["חשמל"])[0]['שם הספק'].tolist() == ["אלון"]
+    category = app.SUPPLIER_COLUMNS.index('תחום עיסוק') + 1
+    app.cache_update_row("suppliers", 'שם הספק', "דני", {category: "חשמל"})
+    df = app.get_worksheet_data("suppliers")
+    filtered, counts = app.filter_suppliers(df, "דני", ["חשמל"])
+    assert filtered['שם הספק'].tolist() == ["דני"]
+    assert counts == {'חשמל': 1}
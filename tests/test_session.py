@@ -0,0 +1,24 @@
+import app
+
+def test_session_token_round_trip():
+    token = app.make_session_token("a@x.com", "hash1")
+    assert app.read_session_token(token) == ("a@x.com", app._password_fingerprint("hash1"))
+
+def test_session_token_rejects_tampering_and_expiry():
+    token = app.make_session_token("a@x.com", "hash1")
+    forged = app.base64.urlsafe_b64encode(
+        app.base64.urlsafe_b64decode(token).replace(b"a@x.com", b"b@x.com")).decode('ascii')
+    assert app.read_session_token(forged) is None
+    assert app.read_session_token("garbage") is None
+    assert app.read_session_token(app.make_session_token("a@x.com", "hash1", days=-1)) is None
+
+def test_password_change_invalidates_token():
+    _, fingerprint = app.read_session_token(app.make_session_token("a@x.com", "hash1"))
+    assert fingerprint != app._password_fingerprint("hash2")
+
+def test_password_hash_round_trip(monkeypatch):
+    monkeypatch.setattr(app, "BCRYPT_ROUNDS", 4)
+    hashed = app.hash_password("secret1")
+    assert app.verify_password("secret1", hashed)
+    assert not app.verify_password("secret2", hashed)
+    assert not app.verify_password("secret1", "not a hash")
@@ -0,0 +1,104 @@
+import types
+
+import pytest
+import requests
+
+import app
+
+def delete(worksheet, keys, key_col='username', key_index=1):
+    return {'op': 'delete', 'worksheet': worksheet, 'key_col': key_col, 'key_index': key_index, 'keys': keys}
+
+def usernames(storage, worksheet="pending_users"):
+    return [r['username'] for r in storage.get_records(worksheet)]
+
+def test_match_key_rows_takes_one_row_per_key_occurrence():
+    assert app.match_key_rows(["a", "b", " a ", "a"], ["a", "a"]) == [2, 4]
+    assert app.match_key_rows(["a", "b"], ["zz"]) == []
+
+def test_merge_row_ranges_bottom_up():
+    assert app.merge_row_ranges([2, 3, 4, 7, 9, 8, 3]) == [(7, 9), (2, 4)]
+
+def test_sqlite_round_trip(storage):
+    storage.append_rows("users", [["a@x.com", "h", "user", "A"], ["b@x.com", "h", "user"]])
+    storage.update_cells("users", 3, {3: "admin", 4: "B"})
+    assert storage.get_records("users")[1] == {'username': "b@x.com", 'password': "h", 'role': "admin", 'name': "B"}
+    storage.delete_rows("users", [2])
+    assert usernames(storage, "users") == ["b@x.com"]
+
+def test_sqlite_rejects_unknown_worksheets(storage):
+    with pytest.raises(KeyError): storage.get_records("nope")
+
+def test_sqlite_batch_resolves_repeated_deletes_in_order(storage):
+    storage.append_rows("pending_users", [[u, "h", "", ""] for u in ["a@x.com", "b@x.com", "a@x.com", "a@x.com"]])
+    storage.apply_batch([delete("pending_users", ["a@x.com"]), delete("pending_users", ["a@x.com"]),
+                         {'op': 'append', 'worksheet': "users", 'rows': [["a@x.com", "h", "user", "A"]]}])
+    assert usernames(storage) == ["b@x.com", "a@x.com"]
+    assert usernames(storage, "users") == ["a@x.com"]
+
+def test_sqlite_batch_rolls_back_on_error(storage):
+    storage.append_rows("pending_users", [["a@x.com", "h", "", ""]])
+    with pytest.raises(KeyError):
+        storage.apply_batch([delete("pending_users", ["a@x.com"]), {'op': 'append', 'worksheet': "nope", 'rows': [["x"]]}])
+    assert usernames(storage) == ["a@x.com"]
+
+def test_sheets_batch_deletes_each_occurrence_once(monkeypatch):
+    column = [["a"], ["b"], ["a"], ["c"], ["a"]]
+    sent = []
+    spreadsheet = types.SimpleNamespace(
+        values_batch_get=lambda ranges: {'valueRanges': [{'values': column} for _ in ranges]},
+        batch_update=lambda body: sent.append(body))
+    conn = types.SimpleNamespace(spreadsheet=lambda: spreadsheet, worksheet=lambda ws: types.SimpleNamespace(id=7))
+    monkeypatch.setattr(app, "get_google_connection", lambda: conn)
+    sheets = app.SheetsStorage(app.GoogleGateway())
+    sheets.apply_batch([delete("suppliers", ["a"]), delete("suppliers", ["a"]), delete("suppliers", ["c", "zz"])])
+    ranges = [r['deleteDimension']['range'] for r in sent[0]['requests']]
+    # שורות 2 ו-4 (שני מופעים של a) ושורה 5 (c), מלמטה למעלה
+    assert [(r['startIndex'], r['endIndex']) for r in ranges] == [(3, 5), (1, 2)]
+
+class HttpError(Exception):
+    def __init__(self, status):
+        super().__init__(status)
+        self.response = types.SimpleNamespace(status_code=status)
+
+@pytest.mark.parametrize("error", [requests.exceptions.ConnectionError(), requests.exceptions.ReadTimeout(),
+                                   TimeoutError(), HttpError(503)])
+def test_ambiguous_failures_retry_only_idempotent_calls(error):
+    assert app._is_retryable(error)
+    assert not app._is_retryable(error, idempotent=False)
+
+def test_quota_errors_always_retry_and_client_errors_never():
+    assert app._is_retryable(HttpError(429), idempotent=False)
+    assert not app._is_retryable(HttpError(404))
+
+def flaky(error, failures=1):
+    calls = []
+    def fn():
+        calls.append(1)
+        if len(calls) <= failures: raise error
+        return len(calls)
+    return fn, calls
+
+def test_gateway_retries_then_gives_up(monkeypatch):
+    monkeypatch.setattr(app.time, "sleep", lambda s: None)
+    gateway = app.GoogleGateway()
+    fn, calls = flaky(HttpError(503))
+    assert gateway.call('sheets_read', fn) == 2
+    fn, calls = flaky(HttpError(503), failures=app.RETRY_ATTEMPTS)
+    with pytest.raises(HttpError): gateway.call('sheets_read', fn)
+    assert len(calls) == app.RETRY_ATTEMPTS
+    assert gateway.stats['sheets_read']['errors'] == 1
+
+def test_gateway_does_not_resend_non_idempotent_writes(monkeypatch):
+    monkeypatch.setattr(app.time, "sleep", lambda s: None)
+    fn, calls = flaky(requests.exceptions.ReadTimeout())
+    with pytest.raises(requests.exceptions.ReadTimeout):
+        app.GoogleGateway().call('sheets_write', fn, idempotent=False)
+    assert len(calls) == 1
+
+def test_token_bucket_waits_once_capacity_is_spent(monkeypatch):
+    clock = types.SimpleNamespace(now=0.0)
+    def sleep(seconds): clock.now += seconds
+    monkeypatch.setattr(app, "time", types.SimpleNamespace(monotonic=lambda: clock.now, sleep=sleep))
+    bucket = app.TokenBucket(60)
+    assert all(bucket.acquire() == 0 for _ in range(60))
+    assert bucket.acquire() == pytest.approx(1.0)
@@ -0,0 +1,65 @@
+import requests
+
+import app
+
+def pending_users(storage):
+    return [r['username'] for r in storage.get_records("pending_users")]
+
+def test_writes_patch_cache_first_and_reach_storage(storage):
+    storage.append_rows("pending_users", [["a@x.com", "h", "A", "d"]])
+    app.get_worksheet_data("pending_users")
+    app.enqueue_writes([app.append_op("users", [["a@x.com", "h", "user", "A"]]),
+                        app.delete_op("pending_users", "username", ["a@x.com"])], "אישור")
+    assert app.get_worksheet_data("pending_users").empty
+    assert app.get_write_queue().wait_for()
+    assert pending_users(storage) == []
+    assert [r['username'] for r in storage.get_records("users")] == ["a@x.com"]
+
+def test_coalesced_deletes_of_a_repeated_key_remove_both_rows(storage):
+    storage.append_rows("pending_users", [["a@x.com", "h", "A", "d"], ["b@x.com", "h", "B", "d"], ["a@x.com", "h", "A", "d"]])
+    app.get_worksheet_data("pending_users")
+    for _ in range(2): app.enqueue_writes([app.delete_op("pending_users", "username", ["a@x.com"])], "דחיה")
+    assert app.get_worksheet_data("pending_users")['username'].tolist() == ["b@x.com"]
+    app.get_write_queue().wait_for()
+    assert pending_users(storage) == ["b@x.com"]
+
+class FailingStorage:
+    def __init__(self, error):
+        self.error = error
+        self.batches = []
+
+    def apply_batch(self, ops):
+        self.batches.append(ops)
+        raise self.error
+
+def run_queue(storage, cache, n=2):
+    q = app.WriteQueue(storage, cache)
+    for i in range(n):
+        q.submit([app.append_op("users", [[f"u{i}@x.com"]])], f"פעולה {i}", owner="admin@x.com")
+    assert q.wait_for()
+    return q
+
+def test_failed_batch_is_retried_per_item_and_reported(storage):
+    cache = app.WorksheetCache()
+    cache.get("users", app._load_worksheet)
+    failing = FailingStorage(RuntimeError("bad request"))
+    q = run_queue(failing, cache)
+    assert [len(b) for b in failing.batches] == [2, 1, 1]
+    assert q.pop_failures("admin@x.com") == ["פעולה 0: bad request", "פעולה 1: bad request"]
+    assert q.pop_failures("admin@x.com") == []
+    assert "users" not in cache._entries
+
+def test_ambiguous_failure_is_not_resent(storage):
+    failing = FailingStorage(requests.exceptions.ReadTimeout("timeout"))
+    q = run_queue(failing, app.WorksheetCache())
+    assert len(failing.batches) == 1
+    assert len(q.pop_failures("admin@x.com")) == 2
+
+def test_direct_writes_wait_for_queued_writes(storage):
+    app.enqueue_writes([app.append_op("pending_users", [["c@x.com", "h", "C", "d"]])], "הרשמה")
+    assert app.delete_rows_from_sheet("pending_users", "username", ["c@x.com"]) == 1
+    app.enqueue_writes([app.append_op("users", [["a@x.com", "h", "user", "A"]])], "אישור")
+    assert app.find_row_number("users", "username", "a@x.com") == 2
+    app.enqueue_writes([app.append_op("settings", [["", "שוטף + 30"]])], "הגדרות")
+    app.update_settings_list("fields", ["חשמל"])
+    assert storage.get_records("settings") == [{'fields': "חשמל", 'payment_terms': "שוטף + 30"}]